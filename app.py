@@ -1,298 +1,818 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Request, render_template, request, jsonify, session, Response, stream_with_context, send_file, current_app
+import click
 import os
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import uuid
-from groq import Groq
 from config import Config
-from database.db_handler import save_conversation, get_user_conversations, save_image, get_image_by_id
+from database.db_handler import get_user_conversations, get_conversation_summaries, get_history_state, get_conversation_state, search_conversations, backfill_search, store_image, save_image, get_image_by_id, migrate_images_to_store, vacuum_database, get_db_stats
+from database.write_behind import get_write_behind
+from database.export import export_chunks, export_to_path, check_format
+from database.migrations import upgrade, pending_migrations
+from database.jobs import create_job, claim_item, complete_item, fail_item, release_item, get_job, get_job_items
+from database.image_store import image_store, ImageTooLarge
+from services.image_processing import preprocess_image_file, ImageProcessingError
+from services.rendering import render_markdown, render_cached, message_html, render_cache, SANITIZER_VERSION
+from services.metrics import registry as metrics_registry, start_request, current_timings, stage
+from services.llm_client import classify_error, CircuitOpenError
+from services.admission import RateLimited, NO_TICKET
+from services.chat import (get_client, get_admission, chat_metrics, prepare_chat, get_cached_answer, model_messages,
+                           create_completion, text_only_messages, can_fall_back, answer_text, chunk_text,
+                           chat_error_response, rate_limit_error, error_event, finish_answer, finish_cached,
+                           build_system_message, detect_language, user_content, MODEL_NAME, IMAGE_FALLBACK_NOTE)
+from services.job_worker import get_job_pool
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
-import markdown
-import bleach
+import time
+from werkzeug.http import is_resource_modified
+
+class OliveRequest(Request):
+    """Request with a per-route body limit, /api/jobs takes many images at once"""
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'create_batch_job':
+            return current_app.config['JOBS_MAX_REQUEST_BYTES']
+        return current_app.config['MAX_CONTENT_LENGTH']
 
 app = Flask(__name__)
+app.request_class = OliveRequest
 app.config.from_object(Config)
 app.secret_key = app.config['SECRET_KEY']
 
-# Initialize Groq client with better error handling
-try:
-    client = Groq(api_key=app.config['GROQ_API_KEY'])
-except Exception as e:
-    print(f"Failed to initialize Groq client: {str(e)}")
-    client = None
-
 @app.before_request
 def before_request():
+    # Start timing the request's stages
+    start_request(request.endpoint)
+    
     # Create a session ID if not exists
     if 'user_id' not in session:
         session['user_id'] = str(uuid.uuid4())
 
+@app.after_request
+def add_server_timing(response):
+    # Echo the stage timings measured so far; streamed stages only reach /metrics
+    timings = current_timings()
+    if timings is not None:
+        if timings.stages:
+            response.headers['Server-Timing'] = timings.server_timing()
+        timings.finish(response.status_code)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    # Raised when a body goes past MAX_CONTENT_LENGTH (JOBS_MAX_REQUEST_BYTES for /api/jobs)
+    return jsonify({'error': 'Request is too large'}), 413
+
+def collect_app_metrics():
+    """Point-in-time values reported by /metrics"""
+    db = get_db_stats()
+    samples = [
+        ('olive_db_checkouts_total', 'counter', 'Connections checked out of the pool', db['checkouts']),
+        ('olive_db_checkout_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection', db['checkout_wait_total']),
+        ('olive_db_checkout_wait_max_seconds', 'gauge', 'Longest wait for a pooled connection', db['checkout_wait_max']),
+        ('olive_db_queries_total', 'counter', 'Queries executed', db['queries']),
+        ('olive_db_query_seconds_total', 'counter', 'Time spent executing queries', db['query_time_total']),
+        ('olive_db_slow_queries_total', 'counter', 'Queries slower than DB_SLOW_QUERY_MS', db['slow_queries']),
+        ('olive_render_cache_entries', 'gauge', 'Rendered messages held in the render cache', len(render_cache)),
+    ]
+    if 'pool_checked_out' in db:
+        samples.append(('olive_db_pool_checked_out', 'gauge', 'Connections currently checked out', db['pool_checked_out']))
+        samples.append(('olive_db_pool_overflow', 'gauge', 'Connections open beyond the pool size', db['pool_overflow']))
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind = get_write_behind(app.config['WRITE_BEHIND_MAX_QUEUE'],
+                                        app.config['WRITE_BEHIND_FLUSH_INTERVAL'],
+                                        app.config['WRITE_BEHIND_MAX_BATCH'])
+        samples.append(('olive_write_behind_pending', 'gauge', 'Chat turns waiting to be saved', write_behind.pending()))
+    samples.extend(chat_metrics())
+    return samples
+
+metrics_registry.register_collector(collect_app_metrics)
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # The sidebar cache in localStorage is namespaced per session, so a shared browser
+    # never shows one visitor's conversations to the next
+    history_key = hashlib.sha256(f"{app.config['SECRET_KEY']}:{session['user_id']}".encode('utf-8')).hexdigest()[:16]
+    return render_template('index.html', history_key=history_key)
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+def check_client():
+    """Return an error response if the Groq client can't be used, otherwise None"""
     # Check if API key is configured
     if app.config['GROQ_API_KEY'] is None or app.config['GROQ_API_KEY'] == '':
         return jsonify({'error': 'GROQ_API_KEY is not configured'}), 500
         
-    if client is None:
+    if get_client() is None:
         return jsonify({'error': 'Groq client failed to initialize'}), 500
-    
-    data = request.json
-    message = data.get('message', '')
-    image_data = data.get('image')
+    return None
+
+def admit_chat(user_id):
+    """Wait for a model slot. Returns (ticket, None), or (None, 429 response) when the user has to back off."""
+    admission = get_admission()
+    if admission is None:
+        return NO_TICKET, None
+    try:
+        with stage('admission'):
+            return admission.acquire(user_id), None
+    except RateLimited as e:
+        status, body, headers = rate_limit_error(e)
+        return None, (jsonify(body), status, headers)
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    error_response = check_client()
+    if error_response:
+        return error_response
     
     user_id = session['user_id']
-    conversation_id = data.get('conversation_id') or str(uuid.uuid4())
-    
-    # Detect language from user message for concise response
-    user_language = "en"  # Default to English
-    if message and len(message.strip()) > 0:
-        # Simple language detection based on common words
-        message_lower = message.lower()
-        if any(word in message_lower for word in ['bonjour', 'salut', 'merci', 'comment']):
-            user_language = "fr"
-        elif any(word in message_lower for word in ['hola', 'gracias', 'como', 'qué']):
-            user_language = "es"
-        elif any(word in message_lower for word in ['مرحبا', 'شكرا', 'كيف', 'سلام']):
-            user_language = "ar"
-    
-    # Set memory cutoff - how many previous messages to include
-    memory_cutoff = 10
-    
-    # Prepare the system message for olive expertise with language and conciseness instruction
-    system_message = f"""
-    You are an expert in agriculture, specifically olives and olive diseases. 
-    Provide accurate and helpful information about olive cultivation, diseases, treatments, 
-    and best practices. Your answers should be informative and understandable to farmers 
-    and enthusiasts. If an image is provided, analyze it for signs of diseases or issues 
-    with olive trees or fruits.
-    
-    IMPORTANT INSTRUCTIONS:
-    1. Format your responses using markdown for better readability.
-    2. Be concise and to the point. Limit your response to 3-4 sentences when possible.
-    3. Respond in the same language as the user's query. The detected language is: {user_language}.
-    4. For diseases, quickly identify the disease name, key symptoms, and basic treatment.
-    5. Refer to the chat history to maintain context in the conversation.
-    6. Address the user as Zouhaier in your responses.
-    7. If the user mentions something from earlier in the conversation, acknowledge it.
-    """
+    chat_request = prepare_chat(request.json, user_id)
     
-    # Format messages for the API
-    messages = [{"role": "system", "content": system_message}]
+    # Repeated first-turn questions are answered from the cache, without using a model slot
+    with stage('cache'):
+        cached = get_cached_answer(chat_request)
+    if cached is not None:
+        return jsonify(finish_cached(user_id, chat_request, cached))
     
-    # Get conversation history if available
+    ticket, error_response = admit_chat(user_id)
+    if error_response:
+        return error_response
     try:
-        history = get_user_conversations(user_id, conversation_id)
-        
-        # Only include the last 'memory_cutoff' messages
-        limited_history = history[-memory_cutoff:] if len(history) > memory_cutoff else history
-        
-        for msg in limited_history:
-            role = "assistant" if msg.get("is_bot", False) else "user"
-            content = msg.get("message", "")
-            messages.append({"role": role, "content": content})
+        return answer_chat(user_id, chat_request)
+    finally:
+        # Hand the slot to the next queued request
+        ticket.release()
+
+def answer_chat(user_id, chat_request):
+    """Answer a chat request from the model once it holds a model slot"""
+    messages, fallback = model_messages(chat_request)
+    try:
+        with stage('groq'):
+            response = create_completion(messages)
     except Exception as e:
-        print(f"Error retrieving conversation history: {str(e)}")
-        # Continue without history if there's an error
-    
-    image_id = None
-    # Prepare the user message with text and optional image
-    if image_data:
-        # Save image to database if it exists
-        try:
-            # Extract base64 data
-            if "base64," in image_data:
-                image_base64 = image_data.split("base64,")[1]
-            else:
-                image_base64 = image_data
-                
-            # Save image and get ID
-            image_id = save_image(user_id, conversation_id, image_base64)
-        except Exception as e:
-            print(f"Error saving image: {str(e)}")
-        
-        # Prepare content array for multimodal input
-        content_array = []
+        print(f"Groq API error: {str(e)}")
+        if not can_fall_back(chat_request, fallback, e):
+            status, body, headers = chat_error_response(e)
+            return jsonify(body), status, headers
         
-        # Add text part if present
-        if message:
-            content_array.append({
-                "type": "text",
-                "text": message
-            })
-        
-        # Add image to content array
-        content_array.append({
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{image_base64}"
-            }
-        })
+        # The model rejected the image, ask again with text only
+        try:
+            print("Attempting fallback to text-only request")
+            with stage('groq_fallback'):
+                response = create_completion(text_only_messages(chat_request))
+            fallback = True
+        except Exception as fallback_error:
+            print(f"Fallback also failed: {str(fallback_error)}")
+            status, body, headers = chat_error_response(fallback_error)
+            return jsonify(body), status, headers
+    
+    return jsonify(finish_answer(user_id, chat_request, answer_text(response, fallback), fallback))
+
+def sse_event(event, data):
+    """Format a Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat but pushes tokens to the browser as Server-Sent Events"""
+    error_response = check_client()
+    if error_response:
+        return error_response
+    
+    user_id = session['user_id']
+    chat_request = prepare_chat(request.json, user_id)
+    timings = current_timings()
+    
+    # Repeated first-turn questions are answered from the cache in a single event, without a model slot
+    with stage('cache'):
+        cached = get_cached_answer(chat_request)
+    if cached is not None:
+        def generate_cached():
+            yield sse_event('meta', {'conversation_id': chat_request['conversation_id']})
+            yield sse_event('token', {'text': cached})
+            yield sse_event('done', finish_cached(user_id, chat_request, cached))
         
-        # Add the multimodal message
-        messages.append({
-            "role": "user",
-            "content": content_array
+        return Response(stream_with_context(generate_cached()), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
         })
-    else:
-        # Just add the text message if no image
-        messages.append({"role": "user", "content": message})
     
-    # Call the Groq API
-    try:
-        print(f"Sending request to Groq API with model: meta-llama/llama-4-scout-17b-16e-instruct")
-        print(f"Number of messages in context: {len(messages)}")
-        
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=messages,
-            temperature=0.5,
-            max_tokens=1024
-        )
-        
-        bot_response = response.choices[0].message.content
-        
-        # Convert markdown to HTML for the response
-        html_response = markdown.markdown(bot_response)
-        
-        # Sanitize HTML to prevent XSS
-        allowed_tags = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 
-                       'ul', 'ol', 'li', 'blockquote', 'code', 'pre', 'br', 'a']
-        allowed_attrs = {'a': ['href', 'title']}
-        html_response = bleach.clean(html_response, tags=allowed_tags, attributes=allowed_attrs)
-        
-        # Save the conversation to the database
-        timestamp = datetime.now()  # Using Python datetime object, not ISO string
-        
-        # Try to save, but continue even if it fails
-        db_save_success = True
+    ticket, error_response = admit_chat(user_id)
+    if error_response:
+        return error_response
+    
+    def generate():
+        yield sse_event('meta', {'conversation_id': chat_request['conversation_id']})
         
-        # Save user's message
-        user_msg = message if message else "[Image uploaded]"
+        chunks = []
+        messages, fallback = model_messages(chat_request)
+        if fallback:
+            chunks.append(IMAGE_FALLBACK_NOTE)
+            yield sse_event('token', {'text': IMAGE_FALLBACK_NOTE})
+        groq_started = time.perf_counter()
+        first_token = True
         try:
-            save_conversation(user_id, conversation_id, user_msg, False, timestamp, image_id)
+            try:
+                stream = create_completion(messages, stream=True)
+            except Exception as e:
+                # The image is rejected before any token is produced, so we can still fall back
+                if not can_fall_back(chat_request, fallback, e):
+                    raise
+                print(f"Groq API error: {str(e)}")
+                print("Attempting fallback to text-only request")
+                stream = create_completion(text_only_messages(chat_request), stream=True)
+                fallback = True
+                chunks.append(IMAGE_FALLBACK_NOTE)
+                yield sse_event('token', {'text': IMAGE_FALLBACK_NOTE})
+            
+            for chunk in stream:
+                delta = chunk_text(chunk)
+                if delta:
+                    if first_token:
+                        timings.record('groq_ttfb', time.perf_counter() - groq_started)
+                        first_token = False
+                    chunks.append(delta)
+                    yield sse_event('token', {'text': delta})
         except Exception as e:
-            print(f"Error saving user message: {str(e)}")
-            db_save_success = False
+            print(f"Groq API streaming error: {str(e)}")
+            yield sse_event('error', error_event(e))
+            return
+        timings.record('groq', time.perf_counter() - groq_started)
+        # The model is done, rendering and saving don't need the slot
+        ticket.release()
         
-        # Save bot's response - save the markdown version in the database
+        yield sse_event('done', finish_answer(user_id, chat_request, ''.join(chunks), fallback))
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+    })
+    # Covers errors and clients that disconnect mid-stream
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def upload_image():
+    """Stream an image to the image store, as multipart/form-data or a raw image body"""
+    user_id = session['user_id']
+    max_bytes = app.config['MAX_UPLOAD_BYTES']
+    
+    # Reject oversized uploads before reading the body when the client declares a length
+    if request.content_length and request.content_length > max_bytes + 64 * 1024:
+        return jsonify({'error': 'Image is too large'}), 413
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            return jsonify({'error': 'No image provided'}), 400
+        stream = upload.stream
+        mime_type = upload.mimetype
+        conversation_id = request.form.get('conversation_id')
+    else:
+        stream = request.stream
+        mime_type = request.mimetype
+        conversation_id = request.args.get('conversation_id')
+    
+    if not mime_type or not mime_type.startswith('image/'):
+        return jsonify({'error': 'Unsupported file type'}), 415
+    
+    conversation_id = conversation_id or str(uuid.uuid4())
+    
+    try:
+        temp_path, _, size = image_store.receive_stream(stream, max_bytes)
         try:
-            save_conversation(user_id, conversation_id, bot_response, True, timestamp)
-        except Exception as e:
-            print(f"Error saving bot response: {str(e)}")
-            db_save_success = False
-        
-        if not db_save_success:
-            print("Warning: Failed to save conversation to database")
-        
-        return jsonify({
-            'response': html_response,  # Send the HTML version to the frontend
-            'raw_response': bot_response,  # Also send the raw markdown for history
-            'conversation_id': conversation_id
-        })
-        
+            if size == 0:
+                return jsonify({'error': 'No image provided'}), 400
+            # Downscale, strip EXIF and thumbnail in the worker pool, the original is not kept
+            with stage('image'):
+                image_bytes, mime_type, thumb_bytes = preprocess_image_file(temp_path)
+        finally:
+            os.remove(temp_path)
+        with stage('db_write'):
+            image_id = save_image(user_id, conversation_id, image_bytes, mime_type, thumb_bytes)
+    except ImageTooLarge:
+        return jsonify({'error': 'Image is too large'}), 413
+    except ImageProcessingError as e:
+        print(f"Rejected upload: {str(e)}")
+        return jsonify({'error': 'Unsupported image format'}), 415
     except Exception as e:
-        error_msg = str(e)
-        print(f"Groq API error: {error_msg}")
-        
-        # If there's a specific error about multimedia content not being supported
-        if "multimodal" in error_msg.lower() or "content array" in error_msg.lower() or "image" in error_msg.lower():
-            # Fallback to text-only request
-            try:
-                print("Attempting fallback to text-only request")
-                # Replace the multimodal message with text-only
-                if image_data:
-                    # Find and replace the last message (which would be the multimodal one)
-                    messages[-1] = {
-                        "role": "user", 
-                        "content": message if message else "I've uploaded an image of olive trees/fruits. Please analyze it for any visible issues or diseases."
-                    }
-                    
-                    response = client.chat.completions.create(
-                        model="meta-llama/llama-4-scout-17b-16e-instruct",
-                        messages=messages,
-                        temperature=0.5,
-                        max_tokens=1024
-                    )
-                    
-                    bot_response = response.choices[0].message.content
-                    fallback_note = "**Note: I couldn't process the image, but I can still help with your text query.**\n\n"
-                    bot_response = fallback_note + bot_response
-                    
-                    # Convert markdown to HTML
-                    html_response = markdown.markdown(bot_response)
-                    html_response = bleach.clean(html_response, tags=allowed_tags, attributes=allowed_attrs)
-                    
-                    # Save conversations with proper datetime object
-                    timestamp = datetime.now()
-                    user_msg = message if message else "[Image uploaded]"
-                    save_conversation(user_id, conversation_id, user_msg, False, timestamp, image_id)
-                    save_conversation(user_id, conversation_id, bot_response, True, timestamp)
-                    
-                    return jsonify({
-                        'response': html_response,
-                        'raw_response': bot_response,
-                        'conversation_id': conversation_id
-                    })
-                
-            except Exception as fallback_error:
-                print(f"Fallback also failed: {str(fallback_error)}")
-                
-        return jsonify({
-            'error': error_msg,
-            'message': "There was an error processing your request. If you uploaded an image, please try again with text only as this model may not support image processing through the Groq API."
-        }), 500
+        print(f"Error saving upload: {str(e)}")
+        return jsonify({'error': 'Error saving image'}), 500
+    
+    return jsonify({
+        'image_id': image_id,
+        'conversation_id': conversation_id
+    })
+
+def encode_cursor(summary):
+    """Turn the last summary of a page into an opaque pagination cursor"""
+    raw = f"{summary['timestamp']}|{summary['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Turn a pagination cursor back into a (timestamp, conversation_id) tuple"""
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    timestamp, conversation_id = raw.split('|', 1)
+    return datetime.fromisoformat(timestamp), conversation_id
+
+def encode_since(timestamp):
+    """Turn the newest message time a client has seen into an opaque sync cursor"""
+    return base64.urlsafe_b64encode(timestamp.isoformat().encode('utf-8')).decode('ascii')
+
+def decode_since(cursor):
+    return datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+
+def make_etag(*parts):
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+
+def utc_last_modified(timestamp):
+    """Stored timestamps are naive local time, HTTP dates are UTC"""
+    return timestamp.astimezone(timezone.utc) if timestamp else None
+
+def conditional_json(build, etag, last_modified):
+    """JSON response that is only built when the client's copy is stale, 304 otherwise"""
+    last_modified = utc_last_modified(last_modified)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = jsonify(build())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Per-user data: the browser keeps it but revalidates every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
+    """List the user's conversations newest first, one page at a time.
+    
+    With `since` (the sync cursor of an earlier response) only conversations changed after it are returned.
+    """
     user_id = session['user_id']
+    
+    limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+    
+    before = None
+    since = None
     try:
-        history = get_user_conversations(user_id)
+        if request.args.get('since'):
+            since = decode_since(request.args['since'])
+        elif request.args.get('cursor'):
+            before = decode_cursor(request.args['cursor'])
+    except Exception:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    try:
+        # Every saved message changes the message count, even one committed after a newer message
+        with stage('db_read'):
+            state = get_history_state(user_id)
+        last_timestamp = state['last_timestamp']
+        etag = make_etag(user_id, state['count'], state['messages'], last_timestamp.isoformat() if last_timestamp else '')
         
-        # Convert markdown to HTML for all bot messages in history
-        for conversation in history:
-            for msg in conversation['messages']:
-                if msg.get('is_bot') and not msg.get('message', '').startswith('<'):
-                    # Convert markdown to HTML
-                    msg['message'] = markdown.markdown(msg['message'])
-                    
-                    # Sanitize HTML
-                    allowed_tags = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 
-                                   'ul', 'ol', 'li', 'blockquote', 'code', 'pre', 'br', 'a']
-                    allowed_attrs = {'a': ['href', 'title']}
-                    msg['message'] = bleach.clean(msg['message'], tags=allowed_tags, attributes=allowed_attrs)
+        def build():
+            body = {
+                'since': encode_since(last_timestamp) if last_timestamp else None,
+                'count': state['count']
+            }
+            if since:
+                # Turns are timestamped before they're committed, so look back a little for late commits
+                overlap = timedelta(seconds=app.config['HISTORY_SYNC_OVERLAP'])
+                with stage('db_read'):
+                    changed = get_conversation_summaries(user_id, app.config['HISTORY_MAX_PAGE_SIZE'] + 1,
+                                                         since=since - overlap)
+                # Too many changes to be worth a delta, the client reloads instead
+                body['reset'] = len(changed) > app.config['HISTORY_MAX_PAGE_SIZE']
+                body['conversations'] = [] if body['reset'] else changed
+                return body
+            
+            # Fetch one extra row to know whether there is another page
+            with stage('db_read'):
+                summaries = get_conversation_summaries(user_id, limit + 1, before)
+            next_cursor = None
+            if len(summaries) > limit:
+                summaries = summaries[:limit]
+                next_cursor = encode_cursor(summaries[-1])
+            body['conversations'] = summaries
+            body['next_cursor'] = next_cursor
+            return body
         
-        return jsonify(history)
+        return conditional_json(build, etag, last_timestamp)
     except Exception as e:
         print(f"Error retrieving history: {str(e)}")
-        return jsonify([]), 500
+        return jsonify({'conversations': [], 'next_cursor': None}), 500
+
+@app.route('/api/history/<conversation_id>', methods=['GET'])
+def get_conversation_history(conversation_id):
+    """Get the messages of a single conversation"""
+    user_id = session['user_id']
+    try:
+        with stage('db_read'):
+            state = get_conversation_state(user_id, conversation_id)
+        last_timestamp = state['last_timestamp'] if state else None
+        # Bot messages are re-rendered when the sanitizer changes, so its version is part of the validator
+        etag = make_etag(user_id, conversation_id, state['message_count'] if state else 0,
+                         last_timestamp.isoformat() if last_timestamp else '', SANITIZER_VERSION)
+        
+        def build():
+            with stage('db_read'):
+                rows = get_user_conversations(user_id, conversation_id)
+            
+            messages = []
+            with stage('render'):
+                for msg in rows:
+                    messages.append({
+                        # Bot messages are served as HTML rendered at write time or from the render cache
+                        'message': message_html(msg) if msg.get('is_bot') else msg['message'],
+                        'is_bot': msg['is_bot'],
+                        'timestamp': msg['timestamp'],
+                        'image_id': msg.get('image_id')
+                    })
+            
+            return {
+                'id': conversation_id,
+                'messages': messages
+            }
+        
+        return conditional_json(build, etag, last_timestamp)
+    except Exception as e:
+        print(f"Error retrieving conversation: {str(e)}")
+        return jsonify({'id': conversation_id, 'messages': []}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Search the user's messages, best matches first, one page at a time"""
+    user_id = session['user_id']
+    
+    query = request.args.get('q', '').strip()[:app.config['SEARCH_MAX_QUERY_LENGTH']]
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    
+    limit = request.args.get('limit', app.config['SEARCH_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['SEARCH_MAX_PAGE_SIZE']))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    # Fetch one extra result to know whether there is another page
+    with stage('db_read'):
+        results = search_conversations(user_id, query, limit + 1, offset)
+    next_offset = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_offset = offset + limit
+    
+    return jsonify({
+        'results': results,
+        'next_offset': next_offset
+    })
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+@app.route('/api/export', methods=['GET'])
+def export_history():
+    """Stream the user's messages with their image metadata as NDJSON or Parquet.
+    
+    `since`/`until` are ISO timestamps; `after` is the id of the last row already
+    received, to resume an interrupted download.
+    """
+    user_id = session['user_id']
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        check_format(export_format)
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    chunks = export_chunks(export_format, user_id=user_id, since=since, until=until,
+                           after=request.args.get('after'),
+                           page_size=app.config['EXPORT_PAGE_SIZE'],
+                           batch_size=app.config['EXPORT_BATCH_SIZE'])
+    extension = 'ndjson' if export_format == 'ndjson' else 'parquet'
+    return Response(chunks, mimetype=EXPORT_MIMETYPES[export_format], headers={
+        'Content-Disposition': f'attachment; filename="olive-history.{extension}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Admission key shared by all batch job items, so together they queue for model slots like one user
+JOBS_ADMISSION_KEY = 'batch-jobs'
+
+def job_pool():
+    """The batch job workers of this process, started on first use"""
+    return get_job_pool(lambda: claim_item(app.config['JOBS_LEASE_SECONDS'], app.config['JOBS_MAX_ATTEMPTS']),
+                        run_job_item, app.config['JOBS_WORKERS'], app.config['JOBS_POLL_INTERVAL'])
+
+def run_job_item(item):
+    """Diagnose one image of a batch job with the same model call as /api/chat, saving the result as a turn"""
+    prompt = item['prompt'] or ''
+    if not get_client().supports(MODEL_NAME, 'image'):
+        fail_item(item, f"{MODEL_NAME} doesn't support images")
+        return
+    
+    # Same model slots as interactive chats; the number of workers already bounds the rate
+    ticket = NO_TICKET
+    admission = get_admission()
+    if admission is not None:
+        try:
+            ticket = admission.acquire(JOBS_ADMISSION_KEY, rate_limited=False)
+        except RateLimited as e:
+            # Busy with interactive chats, try again later without using up an attempt
+            release_item(item, e.retry_after)
+            return
+    
+    try:
+        image_base64 = base64.b64encode(image_store.read_bytes(item['sha256'])).decode('ascii')
+        messages = [
+            {"role": "system", "content": build_system_message(detect_language(prompt))},
+            {"role": "user", "content": user_content(prompt, image_base64, item['mime_type'])}
+        ]
+        response = create_completion(messages)
+        bot_response = response.choices[0].message.content
+    except Exception as e:
+        print(f"Job item {item['id']} failed on attempt {item['attempts']}: {str(e)}")
+        # The client already retried quickly; these get a slower retry from the queue
+        retry_delay = None
+        if classify_error(e) in ('rate_limited', 'server', 'connection', 'circuit_open') \
+                and item['attempts'] < app.config['JOBS_MAX_ATTEMPTS']:
+            retry_delay = app.config['JOBS_RETRY_BASE_DELAY'] * 2 ** (item['attempts'] - 1)
+            if isinstance(e, CircuitOpenError):
+                retry_delay = max(retry_delay, e.retry_after)
+        fail_item(item, str(e), retry_delay)
+        return
+    finally:
+        ticket.release()
+    
+    html_response = render_markdown(bot_response)
+    complete_item(item, bot_response, html_response, SANITIZER_VERSION, prompt or "[Image uploaded]")
+
+def receive_job_image(upload, max_bytes):
+    """Stream one uploaded file to a temp file. Returns (temp_path, None) or (None, error)."""
+    if not upload.mimetype or not upload.mimetype.startswith('image/'):
+        return None, 'Unsupported file type'
+    try:
+        temp_path, _, size = image_store.receive_stream(upload.stream, max_bytes)
+    except ImageTooLarge:
+        return None, 'Image is too large'
+    if size == 0:
+        os.remove(temp_path)
+        return None, 'Empty file'
+    return temp_path, None
+
+def store_job_image(temp_path):
+    """Preprocess a received file and write it to the image store. Returns (reference, None) or (None, error)."""
+    try:
+        image_bytes, mime_type, thumb_bytes = preprocess_image_file(temp_path)
+        return store_image(image_bytes, mime_type, thumb_bytes), None
+    except ImageProcessingError:
+        return None, 'Unsupported image format'
+    except Exception as e:
+        print(f"Error storing job image: {str(e)}")
+        return None, 'Error saving image'
+    finally:
+        os.remove(temp_path)
+
+@app.route('/api/jobs', methods=['POST'])
+def create_batch_job():
+    """Queue many images (multipart field `images`) with an optional `prompt` for background diagnosis"""
+    error_response = check_client()
+    if error_response:
+        return error_response
+    if not app.config['JOBS_ENABLED']:
+        return jsonify({'error': 'Batch jobs are disabled'}), 404
+    
+    user_id = session['user_id']
+    uploads = request.files.getlist('images')
+    if not uploads:
+        return jsonify({'error': 'No images provided'}), 400
+    if len(uploads) > app.config['JOBS_MAX_IMAGES']:
+        return jsonify({'error': f"At most {app.config['JOBS_MAX_IMAGES']} images per job"}), 413
+    prompt = request.form.get('prompt', '').strip()
+    conversation_id = request.form.get('conversation_id') or str(uuid.uuid4())
+    
+    received = []
+    rejected = []
+    try:
+        # Files arrive one after another on the request stream; preprocessing can then run in parallel
+        for upload in uploads:
+            temp_path, error = receive_job_image(upload, app.config['MAX_UPLOAD_BYTES'])
+            if error:
+                rejected.append({'filename': upload.filename, 'error': error})
+            else:
+                received.append((upload.filename, temp_path))
+        
+        temp_paths = [temp_path for _, temp_path in received]
+        with stage('image'):
+            # IMAGE_WORKERS=0 preprocesses in the request thread
+            if app.config['IMAGE_WORKERS'] > 0:
+                with ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS']) as executor:
+                    results = list(executor.map(store_job_image, temp_paths))
+            else:
+                results = [store_job_image(temp_path) for temp_path in temp_paths]
+    finally:
+        # store_job_image removes the files it processed; these are left after an error
+        for _, temp_path in received:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    images = []
+    for (filename, _), (image, error) in zip(received, results):
+        if error:
+            rejected.append({'filename': filename, 'error': error})
+        else:
+            images.append(dict(image, filename=filename))
+    
+    if not images:
+        return jsonify({'error': 'None of the images could be used', 'rejected': rejected}), 415
+    
+    try:
+        with stage('db_write'):
+            job = create_job(user_id, conversation_id, prompt, images)
+    except Exception:
+        return jsonify({'error': 'Error creating job'}), 500
+    
+    # Otherwise `flask jobs-worker` processes run the queue
+    if app.config['JOBS_IN_PROCESS']:
+        job_pool().notify()
+    return jsonify({'job': job, 'rejected': rejected}), 202, {'Location': f"/api/jobs/{job['id']}"}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """A job's status and progress counters"""
+    job = get_job(session['user_id'], job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/items', methods=['GET'])
+def get_batch_job_items(job_id):
+    """Per-image results of a job in upload order, a page at a time"""
+    after = request.args.get('after', -1, type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    items = get_job_items(session['user_id'], job_id, after, limit + 1)
+    if items is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    next_after = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_after = items[-1]['position']
+    for item in items:
+        item['html'] = render_cached(item['result']) if item['result'] else None
+    return jsonify({'items': items, 'next_after': next_after})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_batch_job(job_id):
+    """Push a job's progress as Server-Sent Events.
+    
+    Each stream ends after JOBS_EVENTS_MAX_SECONDS so it doesn't hold a worker thread for a
+    whole job; EventSource reconnects by itself, or clients can poll GET /api/jobs/<id>.
+    """
+    user_id = session['user_id']
+    job = get_job(user_id, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    interval = app.config['JOBS_EVENTS_INTERVAL']
+    deadline = time.monotonic() + app.config['JOBS_EVENTS_MAX_SECONDS']
+    
+    def generate():
+        # Reconnect delay for EventSource once this stream ends
+        yield f"retry: {int(interval * 1000)}\n\n"
+        last = None
+        idle = 0.0
+        while time.monotonic() < deadline:
+            current = get_job(user_id, job_id)
+            progress = (current['status'], current['completed'], current['failed'])
+            if progress != last:
+                last = progress
+                idle = 0.0
+                yield sse_event('progress', current)
+                if current['status'] == 'done':
+                    yield sse_event('done', current)
+                    return
+            elif idle >= 15:
+                # Comment line, so proxies keep the connection open and disconnects are noticed
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            time.sleep(interval)
+            idle += interval
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/images/<image_id>', methods=['GET'])
 def get_image(image_id):
-    from flask import send_file
-    from io import BytesIO
-    import base64
-    
     try:
-        image_data = get_image_by_id(image_id)
+        with stage('db_read'):
+            image = get_image_by_id(image_id)
         
-        if not image_data:
+        if not image:
             return "Image not found", 404
-            
-        # Convert base64 to binary
-        binary_data = base64.b64decode(image_data)
         
-        # Create a BytesIO object
-        image_io = BytesIO(binary_data)
+        # Thumbnails are always JPEG; older images without one fall back to the full size
+        path, mime_type, etag = image['path'], image['mime_type'], image['sha256']
+        if request.args.get('size') == 'thumb' and image['thumb_path']:
+            path, mime_type, etag = image['thumb_path'], 'image/jpeg', image['thumb_sha256']
         
-        # Send the file
-        return send_file(image_io, mimetype='image/jpeg')
+        # Serve straight from the image store; conditional=True adds ETag/Range handling
+        response = send_file(
+            path,
+            mimetype=mime_type,
+            conditional=True,
+            etag=etag,
+            last_modified=utc_last_modified(image['timestamp']),
+            max_age=app.config['IMAGE_CACHE_MAX_AGE']
+        )
+        # send_file marks max_age responses public; images belong to one user
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
     except Exception as e:
         print(f"Error retrieving image: {str(e)}")
         return "Error retrieving image", 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of stage histograms and database counters"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/db-stats', methods=['GET'])
+def db_stats():
+    """Pool checkout waits and query timings, to spot database contention"""
+    return jsonify(get_db_stats())
+
+@app.cli.command('db-upgrade')
+@click.option('--dry-run', is_flag=True, help='Only list the migrations that would be applied.')
+def db_upgrade_command(dry_run):
+    """Create or upgrade the database schema. Run it before starting new app servers."""
+    if dry_run:
+        pending = pending_migrations()
+        for version, name in pending:
+            print(f"Pending migration {version}: {name}")
+        print(f"{len(pending)} pending migrations")
+        return
+    applied = upgrade()
+    print(f"Applied {len(applied)} migrations" if applied else "Database is up to date")
+
+@app.cli.command('migrate-images')
+@click.option('--batch-size', default=100, help='Images moved per transaction.')
+@click.option('--vacuum', is_flag=True, help='Run VACUUM afterwards to shrink the SQLite file.')
+def migrate_images_command(batch_size, vacuum):
+    """Move base64 images out of the database into the image store."""
+    migrated = migrate_images_to_store(batch_size)
+    print(f"Moved {migrated} images to the image store")
+    if vacuum:
+        vacuum_database()
+        print("Database vacuumed")
+
+@app.cli.command('search-backfill')
+@click.option('--batch-size', default=5000, help='Messages indexed per transaction.')
+def search_backfill_command(batch_size):
+    """Add messages saved before full-text search existed to the search index."""
+    indexed = backfill_search(batch_size)
+    print(f"Indexed {indexed} messages")
+
+@app.cli.command('export')
+@click.argument('output')
+@click.option('--format', 'export_format', type=click.Choice(['ndjson', 'parquet']), default='ndjson',
+              help='NDJSON writes one file, Parquet a directory of part files.')
+@click.option('--user', 'user_id', default=None, help='Only export this user_id.')
+@click.option('--since', type=click.DateTime(), default=None, help='Only messages at or after this time.')
+@click.option('--until', type=click.DateTime(), default=None, help='Only messages before this time.')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='Progress file; an interrupted export with the same options resumes from it.')
+@click.option('--rows-per-part', default=1000000, help='Rows per Parquet part file.')
+def export_command(output, export_format, user_id, since, until, checkpoint_path, rows_per_part):
+    """Export messages joined to their image metadata for offline analysis."""
+    try:
+        rows = export_to_path(output, export_format, checkpoint_path, user_id, since, until,
+                              page_size=app.config['EXPORT_PAGE_SIZE'],
+                              batch_size=app.config['EXPORT_BATCH_SIZE'],
+                              rows_per_part=rows_per_part)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Exported {rows} rows to {output}")
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Run batch job workers in the foreground, e.g. on a host that doesn't serve web traffic."""
+    if get_client() is None:
+        raise click.ClickException("Groq client failed to initialize")
+    pool = job_pool()
+    print(f"Running {app.config['JOBS_WORKERS']} job workers, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
+
 if __name__ == '__main__':
+    # Production servers expect `flask db-upgrade` to have run; the dev server does it itself
+    upgrade()
     app.run(debug=True)
\ No newline at end of file
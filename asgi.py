@@ -0,0 +1,320 @@
+"""ASGI entry point: run with `uvicorn asgi:application`.
+
+/api/chat and /api/chat/stream are served natively with the async Groq client, so a
+chat waiting on the model only holds a coroutine instead of a worker thread. Database
+work runs on a small thread pool. Every other route is the regular Flask app.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi
+from app import app, sse_event
+from config import Config
+from services.metrics import start_request, current_timings
+from services.llm_client import AsyncLLMClient
+from services.admission import RateLimited, NO_TICKET
+from services.chat import (get_client as get_sync_client, get_admission, prepare_chat, get_cached_answer, model_messages,
+                           completion_params, text_only_messages, can_fall_back, answer_text, chunk_text,
+                           chat_error_response, rate_limit_error, error_event, finish_answer, finish_cached,
+                           IMAGE_FALLBACK_NOTE)
+
+CHAT_PATHS = ('/api/chat', '/api/chat/stream')
+
+class RequestTooLarge(Exception):
+    pass
+
+class AsyncChatApp:
+    """Serves the chat endpoints asynchronously and hands everything else to Flask"""
+    
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.client = None
+        self.in_flight = None
+        self.db_executor = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_DB_THREADS'],
+                                              thread_name_prefix='async-db')
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in CHAT_PATHS:
+            await self.chat(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+    
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # The semaphore must be created inside the server's event loop
+                self.in_flight = asyncio.Semaphore(self.flask_app.config['ASYNC_MAX_IN_FLIGHT'])
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    await self.client.close()
+                self.db_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def get_client(self):
+        if self.client is None:
+            # Share the breaker, capability memory and counters with the sync client in this process
+            shared = {}
+            sync_client = get_sync_client()
+            if sync_client is not None:
+                shared = {'breaker': sync_client.breaker, 'capabilities': sync_client.capabilities,
+                          'stats': sync_client.stats}
+            self.client = AsyncLLMClient(Config, **shared)
+        return self.client
+    
+    async def run_blocking(self, func, *args):
+        """Run database or CPU bound work off the event loop"""
+        loop = asyncio.get_running_loop()
+        # run_in_executor doesn't carry context variables over, so stage timings would be lost
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.db_executor, functools.partial(context.run, func, *args))
+    
+    def load_user_id(self, scope):
+        """Read the user ID from Flask's signed session cookie. Returns (user_id, new cookie or None)."""
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        cookie_name = self.flask_app.config['SESSION_COOKIE_NAME']
+        
+        for name, value in scope.get('headers', []):
+            if name != b'cookie':
+                continue
+            for part in value.decode('latin-1').split(';'):
+                key, _, cookie_value = part.strip().partition('=')
+                if key == cookie_name:
+                    try:
+                        user_id = serializer.loads(cookie_value).get('user_id')
+                    except Exception:
+                        user_id = None
+                    if user_id:
+                        return user_id, None
+        
+        # Same as before_request in app.py: new visitors get a session ID
+        user_id = str(uuid.uuid4())
+        cookie = f"{cookie_name}={serializer.dumps({'user_id': user_id})}; HttpOnly; Path=/"
+        return user_id, cookie
+    
+    async def read_json(self, receive):
+        """Read the JSON body, raising RequestTooLarge once it goes past MAX_CONTENT_LENGTH"""
+        max_bytes = self.flask_app.config['MAX_CONTENT_LENGTH']
+        # Join the chunks once at the end, appending to bytes would copy the whole body each time
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > max_bytes:
+                raise RequestTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return json.loads(b''.join(chunks) or b'{}')
+    
+    def response_headers(self, headers, cookie):
+        if cookie:
+            headers.append((b'set-cookie', cookie.encode('latin-1')))
+        
+        # Echo the stage timings measured so far and record the request
+        timings = current_timings()
+        if timings is not None and timings.stages:
+            headers.append((b'server-timing', timings.server_timing().encode('latin-1')))
+        return headers
+    
+    def finish_request(self, status):
+        timings = current_timings()
+        if timings is not None:
+            timings.finish(status)
+    
+    async def send_json(self, send, status, payload, cookie=None, extra_headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode('ascii'))]
+        for name, value in (extra_headers or {}).items():
+            headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+        headers = self.response_headers(headers, cookie)
+        self.finish_request(status)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+    
+    async def chat(self, scope, receive, send):
+        config = self.flask_app.config
+        start_request('chat_stream' if scope['path'] == '/api/chat/stream' else 'chat')
+        user_id, cookie = self.load_user_id(scope)
+        
+        # Check if API key is configured
+        if not config['GROQ_API_KEY']:
+            await self.send_json(send, 500, {'error': 'GROQ_API_KEY is not configured'}, cookie)
+            return
+        if get_sync_client() is None:
+            await self.send_json(send, 500, {'error': 'Groq client failed to initialize'}, cookie)
+            return
+        
+        try:
+            data = await self.read_json(receive)
+        except RequestTooLarge:
+            await self.send_json(send, 413, {'error': 'Request is too large'}, cookie)
+            return
+        except ValueError:
+            await self.send_json(send, 400, {'error': 'Invalid JSON body'}, cookie)
+            return
+        
+        stream = scope['path'] == '/api/chat/stream'
+        chat_request = await self.run_blocking(prepare_chat, data, user_id)
+        
+        # Repeated first-turn questions are answered from the cache, without a model slot
+        with current_timings().stage('cache'):
+            cached = await self.run_blocking(get_cached_answer, chat_request)
+        if cached is not None:
+            if stream:
+                await self.stream_cached(send, user_id, chat_request, cached, cookie)
+            else:
+                await self.send_cached(send, user_id, chat_request, cached, cookie)
+            return
+        
+        # Per-user rate limit and fair queue, shared with the Flask routes in this process
+        ticket = NO_TICKET
+        admission = await self.run_blocking(get_admission)
+        if admission is not None:
+            try:
+                with current_timings().stage('admission'):
+                    ticket = await admission.acquire_async(user_id, self.db_executor)
+            except RateLimited as e:
+                status, body, headers = rate_limit_error(e)
+                await self.send_json(send, status, body, cookie, headers)
+                return
+        
+        if self.in_flight is None:
+            self.in_flight = asyncio.Semaphore(config['ASYNC_MAX_IN_FLIGHT'])
+        
+        # Bound how many chats wait on the model at once
+        try:
+            await asyncio.wait_for(self.in_flight.acquire(), timeout=config['ASYNC_QUEUE_TIMEOUT'])
+        except asyncio.TimeoutError:
+            await self.release_ticket(ticket)
+            await self.send_json(send, 503, {'error': 'Server is busy, please try again'}, cookie)
+            return
+        
+        try:
+            if stream:
+                await self.stream_chat(send, user_id, chat_request, cookie)
+            else:
+                await self.complete_chat(send, user_id, chat_request, cookie)
+        finally:
+            self.in_flight.release()
+            await self.release_ticket(ticket)
+    
+    async def release_ticket(self, ticket):
+        # With the sqlite admission backend releasing a slot writes to the database
+        if ticket.controller is not None and ticket.controller.blocking:
+            await self.run_blocking(ticket.release)
+        else:
+            ticket.release()
+    
+    async def create_completion(self, messages, stream=False):
+        return await self.get_client().create(**completion_params(messages, stream))
+    
+    async def complete_chat(self, send, user_id, chat_request, cookie):
+        timings = current_timings()
+        messages, fallback = model_messages(chat_request)
+        try:
+            with timings.stage('groq'):
+                response = await self.create_completion(messages)
+        except Exception as e:
+            print(f"Groq API error: {str(e)}")
+            if not can_fall_back(chat_request, fallback, e):
+                status, body, headers = chat_error_response(e)
+                await self.send_json(send, status, body, cookie, headers)
+                return
+            
+            try:
+                print("Attempting fallback to text-only request")
+                with timings.stage('groq_fallback'):
+                    response = await self.create_completion(text_only_messages(chat_request))
+                fallback = True
+            except Exception as fallback_error:
+                print(f"Fallback also failed: {str(fallback_error)}")
+                status, body, headers = chat_error_response(fallback_error)
+                await self.send_json(send, status, body, cookie, headers)
+                return
+        
+        body = await self.run_blocking(finish_answer, user_id, chat_request, answer_text(response, fallback), fallback)
+        await self.send_json(send, 200, body, cookie)
+    
+    async def send_cached(self, send, user_id, chat_request, bot_response, cookie):
+        body = await self.run_blocking(finish_cached, user_id, chat_request, bot_response)
+        await self.send_json(send, 200, body, cookie)
+    
+    async def start_stream(self, send, chat_request, cookie):
+        """Send the SSE response headers and the meta event. Returns a function that emits further events."""
+        headers = self.response_headers([(b'content-type', b'text/event-stream'),
+                                         (b'cache-control', b'no-cache'),
+                                         (b'x-accel-buffering', b'no')], cookie)
+        self.finish_request(200)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        
+        async def emit(event, payload, more_body=True):
+            await send({'type': 'http.response.body',
+                        'body': sse_event(event, payload).encode('utf-8'),
+                        'more_body': more_body})
+        
+        await emit('meta', {'conversation_id': chat_request['conversation_id']})
+        return emit
+    
+    async def stream_cached(self, send, user_id, chat_request, cached, cookie):
+        """A cached answer as a single token event"""
+        emit = await self.start_stream(send, chat_request, cookie)
+        await emit('token', {'text': cached})
+        body = await self.run_blocking(finish_cached, user_id, chat_request, cached)
+        await emit('done', body, more_body=False)
+    
+    async def stream_chat(self, send, user_id, chat_request, cookie):
+        timings = current_timings()
+        emit = await self.start_stream(send, chat_request, cookie)
+        
+        chunks = []
+        messages, fallback = model_messages(chat_request)
+        if fallback:
+            chunks.append(IMAGE_FALLBACK_NOTE)
+            await emit('token', {'text': IMAGE_FALLBACK_NOTE})
+        groq_started = time.perf_counter()
+        first_token = True
+        try:
+            try:
+                stream = await self.create_completion(messages, stream=True)
+            except Exception as e:
+                # The image is rejected before any token is produced, so we can still fall back
+                if not can_fall_back(chat_request, fallback, e):
+                    raise
+                print(f"Groq API error: {str(e)}")
+                print("Attempting fallback to text-only request")
+                stream = await self.create_completion(text_only_messages(chat_request), stream=True)
+                fallback = True
+                chunks.append(IMAGE_FALLBACK_NOTE)
+                await emit('token', {'text': IMAGE_FALLBACK_NOTE})
+            
+            async for chunk in stream:
+                delta = chunk_text(chunk)
+                if delta:
+                    if first_token:
+                        timings.record('groq_ttfb', time.perf_counter() - groq_started)
+                        first_token = False
+                    chunks.append(delta)
+                    await emit('token', {'text': delta})
+        except Exception as e:
+            print(f"Groq API streaming error: {str(e)}")
+            await emit('error', error_event(e), more_body=False)
+            return
+        timings.record('groq', time.perf_counter() - groq_started)
+        
+        body = await self.run_blocking(finish_answer, user_id, chat_request, ''.join(chunks), fallback)
+        await emit('done', body, more_body=False)
+
+application = AsyncChatApp(app)
@@ -0,0 +1,143 @@
+"""Local stand-in for the Groq chat completions API.
+
+    python -m benchmarks.fake_groq --port 8099 --latency 0.3 --tokens-per-second 200
+
+Then start the app with GROQ_BASE_URL=http://127.0.0.1:8099 and any GROQ_API_KEY.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = '/openai/v1/chat/completions'
+
+ANSWER_WORDS = ("**Peacock spot** (*Venturia oleaginea*) shows as dark circular lesions with a "
+                "yellow halo on olive leaves. Remove fallen leaves, improve airflow by pruning and "
+                "apply a copper-based fungicide in autumn before the rains.").split()
+
+class FakeGroqSettings:
+    def __init__(self, latency=0.3, tokens_per_second=200.0, response_tokens=120):
+        self.latency = latency  # Seconds before the first token
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.requests = 0
+        self.lock = threading.Lock()
+
+def answer_tokens(count):
+    """Deterministic answer of `count` word tokens"""
+    return [ANSWER_WORDS[index % len(ANSWER_WORDS)] + ' ' for index in range(count)]
+
+def make_handler(settings):
+    class FakeGroqHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def log_message(self, format, *args):
+            pass
+        
+        def do_POST(self):
+            if self.path != COMPLETIONS_PATH:
+                self.send_error(404)
+                return
+            
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with settings.lock:
+                settings.requests += 1
+            
+            max_tokens = body.get('max_tokens') or settings.response_tokens
+            tokens = answer_tokens(min(settings.response_tokens, max_tokens))
+            prompt_tokens = sum(len(json.dumps(msg.get('content', ''))) // 4 for msg in body.get('messages', []))
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            created = int(time.time())
+            model = body.get('model', 'fake-model')
+            
+            time.sleep(settings.latency)
+            if body.get('stream'):
+                self.stream(tokens, completion_id, created, model)
+            else:
+                time.sleep(len(tokens) / settings.tokens_per_second)
+                self.send_json({
+                    'id': completion_id,
+                    'object': 'chat.completion',
+                    'created': created,
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': len(tokens),
+                        'total_tokens': prompt_tokens + len(tokens)
+                    }
+                })
+        
+        def send_json(self, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def stream(self, tokens, completion_id, created, model):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            
+            def write_event(payload):
+                data = f"data: {payload}\n\n".encode('utf-8')
+                self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+            
+            delay = 1.0 / settings.tokens_per_second
+            for index, token in enumerate(tokens + [None]):
+                if token is not None:
+                    time.sleep(delay)
+                write_event(json.dumps({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'role': 'assistant', 'content': token} if token is not None else {},
+                        'finish_reason': None if token is not None else 'stop'
+                    }]
+                }))
+            write_event('[DONE]')
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+    
+    return FakeGroqHandler
+
+def start_fake_groq(port=0, settings=None):
+    """Start the fake server on a background thread. Returns (server, settings); server.server_port is the bound port."""
+    settings = settings or FakeGroqSettings()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-groq', daemon=True).start()
+    return server, settings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.3, help='Seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--response-tokens', type=int, default=120)
+    args = parser.parse_args()
+    
+    settings = FakeGroqSettings(args.latency, args.tokens_per_second, args.response_tokens)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(settings))
+    server.daemon_threads = True
+    print(f"Fake Groq API listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Drive /api/chat, /api/history and /api/images/<id> concurrently and report latency percentiles.
+
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --manifest bench_manifest.json \\
+        --concurrency 16 --duration 30 --server-pid 12345
+
+Prints one JSON document: per-endpoint count, errors, RPS and p50/p95/p99 in milliseconds,
+plus peak RSS of this process and of --server-pid and its workers when given.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+# Relative weight of each request type in the mix
+DEFAULT_MIX = {'chat': 1, 'chat_stream': 1, 'history': 3, 'conversation': 3, 'image': 4}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def process_tree(pid):
+    """The process and all its descendants, e.g. a gunicorn master and its workers"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The command name in parentheses may contain spaces, the parent PID follows it
+                parent = int(stat.read().rpartition(')')[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    
+    tree = [pid]
+    for process in tree:
+        tree.extend(children.get(process, []))
+    return tree
+
+def peak_rss_kb(pid=None):
+    """Peak resident set size in KiB. For another process, the sum over it and its
+    descendants from /proc, since pre-fork servers do the work in child processes."""
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    total = None
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total = (total or 0) + int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total
+
+class Worker(threading.Thread):
+    """Sends requests over one keep-alive connection until the deadline"""
+    
+    def __init__(self, base_url, manifest, mix, deadline, results, unique_messages):
+        super().__init__(daemon=True)
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.manifest = manifest
+        self.kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+        self.deadline = deadline
+        self.results = results
+        self.unique_messages = unique_messages
+        self.connection = None
+    
+    def request(self, method, path, cookie, body=None):
+        headers = {'Cookie': f'session={cookie}'}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # The server closed the keep-alive connection, reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt == 1:
+                    raise
+    
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            user = random.choice(self.manifest['users'])
+            kind = random.choice(self.kinds)
+            conversation_id = random.choice(user['conversations']) if user['conversations'] else None
+            
+            if kind in ('chat', 'chat_stream'):
+                message = random.choice(['What is peacock spot?', 'How do I treat olive knot?'])
+                if self.unique_messages:
+                    # Defeat the answer cache so every chat reaches the model
+                    message += f" ({uuid.uuid4().hex[:8]})"
+                path = '/api/chat' if kind == 'chat' else '/api/chat/stream'
+                call = ('POST', path, {'message': message, 'conversation_id': conversation_id})
+            elif kind == 'history':
+                call = ('GET', '/api/history', None)
+            elif kind == 'conversation' and conversation_id:
+                call = ('GET', f'/api/history/{conversation_id}', None)
+            elif kind == 'image' and user['images']:
+                call = ('GET', f"/api/images/{random.choice(user['images'])}", None)
+            else:
+                continue
+            
+            start = time.perf_counter()
+            try:
+                status, body = self.request(call[0], call[1], user['cookie'], call[2])
+                # Streams report failures after the 200 as an `error` event
+                if kind == 'chat_stream' and status < 400 and b'event: error\n' in body:
+                    status = None
+            except Exception:
+                status = None
+            self.results.append((kind, time.perf_counter() - start, status))
+
+def run_load(base_url, manifest, concurrency, duration, mix=None, unique_messages=True, server_pid=None):
+    """Run the load for `duration` seconds and return the report as a dict"""
+    results = []
+    deadline = time.perf_counter() + duration
+    workers = [Worker(base_url, manifest, mix or DEFAULT_MIX, deadline, results, unique_messages)
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    
+    report = {'concurrency': concurrency, 'duration_seconds': elapsed, 'endpoints': {}}
+    for kind in sorted({result[0] for result in results}):
+        latencies = sorted(result[1] for result in results if result[0] == kind)
+        errors = sum(1 for result in results if result[0] == kind and (result[2] is None or result[2] >= 400))
+        report['endpoints'][kind] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    report['total_requests'] = len(results)
+    report['total_rps'] = len(results) / elapsed
+    report['client_peak_rss_kb'] = peak_rss_kb()
+    if server_pid:
+        report['server_peak_rss_kb'] = peak_rss_kb(server_pid)
+    return report
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = int(weight)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='Request weights, e.g. chat=1,chat_stream=1,history=3,conversation=3,image=4')
+    parser.add_argument('--allow-cache-hits', action='store_true', help='Repeat identical chat messages')
+    parser.add_argument('--server-pid', type=int, default=None, help='Report peak RSS of this process and its workers')
+    parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+    report = run_load(args.url, manifest, args.concurrency, args.duration, args.mix,
+                      not args.allow_cache_hits, args.server_pid)
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""End-to-end benchmark: fake Groq server, seeded SQLite database, app server and load test.
+
+    python -m benchmarks.run --users 50 --conversations 20 --messages 40 --concurrency 16 --duration 30
+
+Everything lives in a temporary directory so the real database and image store are untouched.
+The JSON report goes to stdout (or --output) and includes the fake server settings and seed sizes.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fake_groq import start_fake_groq, FakeGroqSettings
+from benchmarks.load_test import run_load
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"App server didn't start listening on port {port}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--conversations', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--image-size', type=int, default=200 * 1024)
+    parser.add_argument('--latency', type=float, default=0.3, help='Fake Groq seconds to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--response-tokens', type=int, default=120)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--server', default='flask', choices=['flask', 'gunicorn', 'uvicorn'],
+                        help='How to serve the app under test')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn/uvicorn worker processes')
+    parser.add_argument('--admission', action='store_true',
+                        help='Keep admission control on; by default it is off so chats reach the model')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='olive-bench-')
+    fake_server, settings = start_fake_groq(0, FakeGroqSettings(args.latency, args.tokens_per_second, args.response_tokens))
+    
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'IMAGE_STORE_DIR': os.path.join(workdir, 'images'),
+        'ANSWER_CACHE_PATH': os.path.join(workdir, 'answer_cache.db'),
+        'GROQ_API_KEY': 'fake-key',
+        'GROQ_BASE_URL': f"http://127.0.0.1:{fake_server.server_port}",
+        'SECRET_KEY': 'benchmark-secret',
+        # Rolling summaries would add background model calls the load test doesn't account for
+        'CONTEXT_SUMMARY_ENABLED': 'false',
+        # Per-user rate limits would turn most synthetic chats into 429s and measure rejections
+        'ADMISSION_ENABLED': 'true' if args.admission else 'false',
+    })
+    
+    manifest_path = os.path.join(workdir, 'manifest.json')
+    subprocess.run([sys.executable, '-m', 'benchmarks.seed',
+                    '--users', str(args.users), '--conversations', str(args.conversations),
+                    '--messages', str(args.messages), '--images', str(args.images),
+                    '--image-size', str(args.image_size), '--manifest', manifest_path],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    
+    port = free_port()
+    if args.server == 'gunicorn':
+        command = ['gunicorn', '-w', str(args.workers), '--threads', '8', '-b', f'127.0.0.1:{port}', 'app:app']
+    elif args.server == 'uvicorn':
+        command = ['uvicorn', '--workers', str(args.workers), '--port', str(port), 'asgi:application']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--no-reload']
+    
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log_file:
+        server = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            wait_for_port(port)
+            report = run_load(f"http://127.0.0.1:{port}", manifest, args.concurrency, args.duration,
+                              server_pid=server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    
+    report['server'] = args.server
+    report['admission'] = args.admission
+    report['seed'] = {
+        'users': args.users,
+        'conversations_per_user': args.conversations,
+        'messages_per_conversation': args.messages,
+        'images_per_conversation': args.images,
+    }
+    report['fake_groq'] = {
+        'latency_seconds': args.latency,
+        'tokens_per_second': args.tokens_per_second,
+        'response_tokens': args.response_tokens,
+        'requests': settings.requests,
+    }
+    report['workdir'] = workdir
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
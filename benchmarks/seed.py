@@ -0,0 +1,126 @@
+"""Fill the database named by DATABASE_URI with synthetic users, conversations and images.
+
+    DATABASE_URI=sqlite:///bench.db python -m benchmarks.seed --users 50 --conversations 20 --messages 30 \\
+        --manifest bench_manifest.json
+
+The manifest lists each user's signed session cookie, conversation IDs and image IDs for the load test.
+"""
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from database.db_handler import Session, Conversation, ConversationSummary, Image
+from database.migrations import upgrade
+from database.image_store import image_store
+
+QUESTIONS = [
+    "What causes the dark spots with yellow rings on my olive leaves?",
+    "How do I treat olive knot after a hail storm?",
+    "My olives are dropping early, is it the olive fruit fly?",
+    "When should I prune a 20 year old Chemlali tree?",
+    "Is copper spraying safe before harvest?",
+]
+
+ANSWER = ("**Peacock spot** (*Venturia oleaginea*) is the most likely cause.\n\n"
+          "- Dark circular lesions with a yellow halo\n- Early leaf drop\n\n"
+          "Prune for airflow and apply a copper fungicide before the autumn rains.")
+
+def fake_jpeg(size):
+    """Bytes that look like a JPEG to MIME sniffing; the app serves them without decoding"""
+    return b'\xff\xd8\xff\xe0' + os.urandom(size - 6) + b'\xff\xd9'
+
+def session_cookie(user_id):
+    # Imported here so seeding without the Flask app installed still works up to this point
+    from app import app
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'user_id': user_id})
+
+def seed(users, conversations, messages, images_per_conversation, image_size, batch_size=5000):
+    manifest = {'users': []}
+    start = datetime.now() - timedelta(days=365)
+    
+    session = Session()
+    try:
+        rows = []
+        
+        def flush(model):
+            if rows:
+                session.bulk_insert_mappings(model, rows)
+                session.commit()
+                rows.clear()
+        
+        for _ in range(users):
+            user_id = str(uuid.uuid4())
+            user = {'user_id': user_id, 'cookie': session_cookie(user_id), 'conversations': [], 'images': []}
+            manifest['users'].append(user)
+            
+            summaries = []
+            for _ in range(conversations):
+                conversation_id = str(uuid.uuid4())
+                user['conversations'].append(conversation_id)
+                timestamp = start + timedelta(minutes=random.randint(0, 500000))
+                
+                image_ids = []
+                for _ in range(images_per_conversation):
+                    image_id = str(uuid.uuid4())
+                    data = fake_jpeg(image_size)
+                    session.add(Image(id=image_id, user_id=user_id, conversation_id=conversation_id,
+                                      image_data='', timestamp=timestamp, sha256=image_store.put_bytes(data),
+                                      mime_type='image/jpeg', size=len(data)))
+                    image_ids.append(image_id)
+                user['images'].extend(image_ids)
+                
+                # Alternate user and bot messages, each turn sharing a timestamp like the app does
+                for index in range(messages):
+                    if index % 2 == 0:
+                        timestamp += timedelta(minutes=random.randint(1, 60))
+                    is_bot = index % 2 == 1
+                    rows.append({
+                        'id': str(uuid.uuid4()),
+                        'user_id': user_id,
+                        'conversation_id': conversation_id,
+                        'message': ANSWER if is_bot else random.choice(QUESTIONS),
+                        'is_bot': is_bot,
+                        'timestamp': timestamp,
+                        'image_id': image_ids[index // 2] if not is_bot and index // 2 < len(image_ids) else None
+                    })
+                    if len(rows) >= batch_size:
+                        flush(Conversation)
+                
+                summaries.append({
+                    'user_id': user_id,
+                    'id': conversation_id,
+                    'title': QUESTIONS[0],
+                    'last_message': ANSWER,
+                    'last_timestamp': timestamp,
+                    'message_count': messages
+                })
+            flush(Conversation)
+            session.bulk_insert_mappings(ConversationSummary, summaries)
+            session.commit()
+    finally:
+        session.close()
+    
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--conversations', type=int, default=10, help='Conversations per user')
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--images', type=int, default=1, help='Images per conversation')
+    parser.add_argument('--image-size', type=int, default=200 * 1024, help='Bytes per image')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    args = parser.parse_args()
+    
+    upgrade()
+    manifest = seed(args.users, args.conversations, args.messages, args.images, args.image_size)
+    with open(args.manifest, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    total = args.users * args.conversations * args.messages
+    print(f"Seeded {args.users} users, {total} messages; manifest written to {args.manifest}")
+
+if __name__ == '__main__':
+    main()
@@ -6,4 +6,140 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-default-secret-key')
     GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
-    DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///olive_chatbot.db')
\ No newline at end of file
+    # Point at another OpenAI-compatible server, e.g. the fake one in benchmarks/
+    GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL') or None
+    
+    # Groq client: keep-alive pool, retries on 429/5xx and the circuit breaker
+    GROQ_MAX_CONNECTIONS = int(os.environ.get('GROQ_MAX_CONNECTIONS', 100))
+    GROQ_KEEPALIVE_CONNECTIONS = int(os.environ.get('GROQ_KEEPALIVE_CONNECTIONS', 20))
+    GROQ_KEEPALIVE_EXPIRY = float(os.environ.get('GROQ_KEEPALIVE_EXPIRY', 60))
+    GROQ_TIMEOUT = float(os.environ.get('GROQ_TIMEOUT', 60))
+    GROQ_CONNECT_TIMEOUT = float(os.environ.get('GROQ_CONNECT_TIMEOUT', 5))
+    GROQ_MAX_RETRIES = int(os.environ.get('GROQ_MAX_RETRIES', 2))
+    GROQ_RETRY_BASE_DELAY = float(os.environ.get('GROQ_RETRY_BASE_DELAY', 0.5))
+    GROQ_RETRY_MAX_DELAY = float(os.environ.get('GROQ_RETRY_MAX_DELAY', 8))
+    # Consecutive 5xx/connection failures that open the breaker, and seconds before it lets a probe through
+    GROQ_BREAKER_THRESHOLD = int(os.environ.get('GROQ_BREAKER_THRESHOLD', 5))
+    GROQ_BREAKER_RESET_SECONDS = float(os.environ.get('GROQ_BREAKER_RESET_SECONDS', 30))
+    # How long a model's rejected feature (e.g. images) is skipped before being tried again
+    GROQ_CAPABILITY_TTL = float(os.environ.get('GROQ_CAPABILITY_TTL', 3600))
+    DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///olive_chatbot.db')
+    
+    # Connection pool, used for file-backed SQLite and server databases
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # Queries slower than this are logged
+    DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', 200))
+    
+    # SQLite pragmas applied to every new connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    
+    # Conversations per /api/history page
+    HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 30))
+    HISTORY_MAX_PAGE_SIZE = 100
+    # Seconds a `since` sync looks back before its cursor, covering turns committed after newer ones
+    HISTORY_SYNC_OVERLAP = float(os.environ.get('HISTORY_SYNC_OVERLAP', 10))
+    
+    # Full-text search over messages
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    SEARCH_MAX_PAGE_SIZE = 50
+    SEARCH_MAX_QUERY_LENGTH = 200
+    
+    # Bulk export: rows per read transaction, and rows fetched and written at a time
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 10000))
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    
+    # Batch diagnosis jobs, queued in the database and run by `flask jobs-worker` processes.
+    # Off by default, since queued jobs only run once a worker is started or JOBS_IN_PROCESS is on.
+    JOBS_ENABLED = os.environ.get('JOBS_ENABLED', 'false').lower() == 'true'
+    # Run workers inside web processes, started by the first upload. Off by default: run
+    # `flask jobs-worker` instead, so web workers don't import the Groq SDK or poll the queue.
+    JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', 'false').lower() == 'true'
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    JOBS_MAX_IMAGES = int(os.environ.get('JOBS_MAX_IMAGES', 500))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 4))
+    # Seconds before the first retry of a failed item, doubled for each later one
+    JOBS_RETRY_BASE_DELAY = float(os.environ.get('JOBS_RETRY_BASE_DELAY', 10))
+    # Seconds after which an item whose worker died is run again
+    JOBS_LEASE_SECONDS = int(os.environ.get('JOBS_LEASE_SECONDS', 300))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 2))
+    JOBS_EVENTS_INTERVAL = float(os.environ.get('JOBS_EVENTS_INTERVAL', 1))
+    # Seconds one /api/jobs/<id>/events stream stays open before the client reconnects
+    JOBS_EVENTS_MAX_SECONDS = float(os.environ.get('JOBS_EVENTS_MAX_SECONDS', 60))
+    
+    # Rendered bot messages kept in memory for rows without stored HTML
+    RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', 2048))
+    
+    # Directory of the content-addressed image store
+    IMAGE_STORE_DIR = os.environ.get('IMAGE_STORE_DIR', 'image_store')
+    # Images never change once stored, so browsers may cache them for a year
+    IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 31536000))
+    # Largest image accepted by /api/uploads, in bytes
+    MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+    # Largest request body, enough for an image sent to /api/chat as a base64 data URL plus form overhead
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024))
+    # Largest /api/jobs request. Any visitor can post one and it's spooled to disk, so it stays
+    # small by default; raise it deliberately to accept up to JOBS_MAX_IMAGES full-size images.
+    JOBS_MAX_REQUEST_BYTES = int(os.environ.get('JOBS_MAX_REQUEST_BYTES', 50 * 1024 * 1024))
+    
+    # Upload preprocessing: long edge cap and JPEG quality for the model, and thumbnail size
+    IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', 1568))
+    IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', 85))
+    IMAGE_THUMB_EDGE = int(os.environ.get('IMAGE_THUMB_EDGE', 400))
+    # Worker processes for preprocessing, 0 runs it in the request thread
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    IMAGE_PROCESS_TIMEOUT = int(os.environ.get('IMAGE_PROCESS_TIMEOUT', 30))
+    
+    # Save chat turns from a background thread instead of inside the request.
+    # A turn can be invisible to the next request for up to WRITE_BEHIND_FLUSH_INTERVAL seconds.
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    WRITE_BEHIND_MAX_QUEUE = int(os.environ.get('WRITE_BEHIND_MAX_QUEUE', 1000))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+    WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 50))
+    
+    # ASGI serving mode (asgi.py): chats waiting on the model at once, how long a chat may
+    # wait for a slot before getting a 503, and threads used for blocking database work.
+    # With admission control on, ADMISSION_MAX_CONCURRENT is the tighter cap on model calls.
+    ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 500))
+    ASYNC_QUEUE_TIMEOUT = float(os.environ.get('ASYNC_QUEUE_TIMEOUT', 30))
+    ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 16))
+    
+    # Cache of first-turn answers: 'none', 'memory', 'sqlite' (shared by workers on a host) or 'tiered'
+    ANSWER_CACHE_BACKEND = os.environ.get('ANSWER_CACHE_BACKEND', 'memory')
+    ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', 24 * 60 * 60))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 5000))
+    ANSWER_CACHE_PATH = os.environ.get('ANSWER_CACHE_PATH', 'answer_cache.db')
+    ANSWER_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_DISK_MAX_ENTRIES', 100000))
+    
+    # Admission control in front of the model: per-user token bucket, global concurrency cap and a fair queue
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    # 'memory' is per process, 'sqlite' shares buckets and slots between workers on one host
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory')
+    ADMISSION_PATH = os.environ.get('ADMISSION_PATH', 'admission.db')
+    # Chat requests per second a user earns, and how many can be made back to back
+    ADMISSION_RATE = float(os.environ.get('ADMISSION_RATE', 0.5))
+    ADMISSION_BURST = float(os.environ.get('ADMISSION_BURST', 5))
+    # Model calls at once, per process with the memory backend and per host with sqlite.
+    # Caps ASYNC_MAX_IN_FLIGHT too; raise both together when serving with asgi.py.
+    ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 16))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 64))
+    ADMISSION_MAX_QUEUE_PER_USER = int(os.environ.get('ADMISSION_MAX_QUEUE_PER_USER', 3))
+    # Seconds a request may wait for a slot before getting a 429
+    ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 10))
+    # Seconds after which a slot held by a crashed worker is reclaimed (sqlite backend)
+    ADMISSION_SLOT_LEASE = float(os.environ.get('ADMISSION_SLOT_LEASE', 300))
+    
+    # Prompt context: tokens available for the system prompt, rolling summary and history,
+    # and how many recent messages are considered at most
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 6000))
+    CONTEXT_MAX_MESSAGES = int(os.environ.get('CONTEXT_MAX_MESSAGES', 50))
+    # Messages that fall out of the window are folded into a rolling summary
+    CONTEXT_SUMMARY_ENABLED = os.environ.get('CONTEXT_SUMMARY_ENABLED', 'true').lower() == 'true'
+    CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_MAX_TOKENS', 300))
+    CONTEXT_SUMMARY_BATCH = int(os.environ.get('CONTEXT_SUMMARY_BATCH', 40))
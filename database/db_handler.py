@@ -1,7 +1,13 @@
-from sqlalchemy import Column, String, Boolean, DateTime, Text, create_engine, LargeBinary
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, String, Boolean, DateTime, Text, Integer, Index, or_, and_, text, func
+from sqlalchemy.orm import declarative_base, sessionmaker
 from config import Config
+from database.engine import create_configured_engine, engine_stats
+from database.image_store import image_store
+from database.search import has_search_index, index_messages, backfill_search_index, search_messages, like_snippet
+from services.image_processing import detect_mime_type, make_thumbnail
+import base64
+import re
+import threading
 import uuid
 from datetime import datetime
 import os
@@ -18,6 +24,14 @@ class Conversation(Base):
     is_bot = Column(Boolean, default=False)
     timestamp = Column(DateTime, nullable=False)
     image_id = Column(String, nullable=True)  # Reference to image if present
+    html = Column(Text, nullable=True)  # Sanitized HTML rendered when the bot message was saved
+    html_version = Column(Integer, nullable=True)  # Sanitizer version that produced `html`
+    
+    # Serves the per-turn "last N messages" lookup; is_bot breaks timestamp ties
+    # between a user message and the bot reply saved with it
+    __table_args__ = (
+        Index('ix_conversations_user_conv_ts', 'user_id', 'conversation_id', 'timestamp', 'is_bot'),
+    )
 
 class Image(Base):
     __tablename__ = 'images'
@@ -25,113 +39,247 @@ class Image(Base):
     id = Column(String, primary_key=True)
     user_id = Column(String, nullable=False)
     conversation_id = Column(String, nullable=False)
-    image_data = Column(Text, nullable=False)  # Base64 encoded image
+    image_data = Column(Text, nullable=False, default='')  # Legacy base64 image, empty once moved to the image store
     timestamp = Column(DateTime, nullable=False)
+    sha256 = Column(String, nullable=True)  # Key of the raw bytes in the image store
+    mime_type = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
+    thumb_sha256 = Column(String, nullable=True)  # Key of the preview-sized JPEG in the image store
 
-# Create engine
-db_path = Config.DATABASE_URI
-if db_path.startswith('sqlite:///'):
-    db_file = db_path.replace('sqlite:///', '')
-    db_dir = os.path.dirname(db_file)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir)
-
-engine = create_engine(Config.DATABASE_URI)
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summaries'
+    
+    # One row per conversation, maintained on every message write
+    user_id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)  # The conversation_id
+    title = Column(Text, nullable=False)  # First message of the conversation
+    last_message = Column(Text, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)
+    context_summary = Column(Text, nullable=True)  # Rolling summary of messages outside the context window
+    summarized_until = Column(DateTime, nullable=True)  # Timestamp of the newest message in context_summary
+    
+    # Serves the newest-first, cursor-paginated sidebar listing
+    __table_args__ = (
+        Index('ix_conversation_summaries_user_last_ts', 'user_id', 'last_timestamp', 'id'),
+    )
 
-# Handle database migration for existing tables
-def setup_database():
-    from sqlalchemy import inspect, MetaData
+class Job(Base):
+    __tablename__ = 'jobs'
     
-    inspector = inspect(engine)
-    metadata = MetaData()
+    # A batch of images diagnosed in the background; results are saved as turns of `conversation_id`
+    id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    conversation_id = Column(String, nullable=False)
+    prompt = Column(Text, nullable=True)
+    status = Column(String, nullable=False)  # queued, running, done
+    total = Column(Integer, nullable=False)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
     
-    # Check if conversations table exists
-    if 'conversations' in inspector.get_table_names():
-        # Check if image_id column exists
-        columns = [col['name'] for col in inspector.get_columns('conversations')]
-        if 'image_id' not in columns:
-            print("Adding image_id column to conversations table...")
-            try:
-                with engine.connect() as connection:
-                    connection.execute("ALTER TABLE conversations ADD COLUMN image_id VARCHAR")
-                    connection.commit()
-                print("Column added successfully")
-            except Exception as e:
-                print(f"Error adding column: {str(e)}")
+    __table_args__ = (
+        Index('ix_jobs_user_created', 'user_id', 'created_at'),
+    )
+
+class JobItem(Base):
+    __tablename__ = 'job_items'
     
-    # Create tables that don't exist
-    Base.metadata.create_all(engine)
+    # One image of a job. The image file is already in the image store; its row is
+    # saved together with the result turn.
+    id = Column(String, primary_key=True)
+    job_id = Column(String, nullable=False)
+    position = Column(Integer, nullable=False)
+    filename = Column(String, nullable=True)
+    status = Column(String, nullable=False)  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    locked_until = Column(DateTime, nullable=True)  # Lease of the worker running it
+    image_id = Column(String, nullable=False)
+    sha256 = Column(String, nullable=False)
+    mime_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    thumb_sha256 = Column(String, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, nullable=False)
     
-    # Check if images table exists
-    if 'images' not in inspector.get_table_names():
-        print("Creating images table...")
-        try:
-            with engine.connect() as connection:
-                connection.execute("""
-                CREATE TABLE images (
-                    id VARCHAR PRIMARY KEY,
-                    user_id VARCHAR NOT NULL,
-                    conversation_id VARCHAR NOT NULL,
-                    image_data TEXT NOT NULL,
-                    timestamp DATETIME NOT NULL
-                )
-                """)
-                connection.commit()
-            print("Images table created successfully")
-        except Exception as e:
-            print(f"Error creating images table: {str(e)}")
+    __table_args__ = (
+        # Claiming takes the lowest position across jobs, so jobs are served round-robin
+        Index('ix_job_items_claim', 'status', 'position', 'next_attempt_at'),
+        Index('ix_job_items_job_position', 'job_id', 'position'),
+    )
+
+_engine = None
+_engine_lock = threading.Lock()
 
-# Run database setup
-setup_database()
+def get_engine():
+    """Create the engine on first use, so importing this module never touches the database.
+    
+    The schema is managed by database/migrations.py (`flask db-upgrade`), not checked here.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                db_path = Config.DATABASE_URI
+                if db_path.startswith('sqlite:///'):
+                    db_dir = os.path.dirname(db_path.replace('sqlite:///', ''))
+                    if db_dir and not os.path.exists(db_dir):
+                        os.makedirs(db_dir)
+                engine = create_configured_engine(Config)
+                Session.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+class LazySessionMaker(sessionmaker):
+    """sessionmaker whose first session creates and binds the engine"""
+    
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
 
 # Create session
-Session = sessionmaker(bind=engine)
+Session = LazySessionMaker()
 
-def save_conversation(user_id, conversation_id, message, is_bot, timestamp, image_id=None):
-    """Save a conversation message to the database"""
-    session = Session()
-    try:
-        # Ensure timestamp is a Python datetime object
-        if isinstance(timestamp, str):
-            try:
-                timestamp = datetime.fromisoformat(timestamp)
-            except ValueError:
-                timestamp = datetime.now()
+_search_enabled = None
+
+def search_enabled():
+    """Whether the FTS5 index exists; False where search falls back to LIKE. Checked once per process."""
+    global _search_enabled
+    if _search_enabled is None:
+        _search_enabled = has_search_index(get_engine())
+    return _search_enabled
+
+def update_summary(session, user_id, conversation_id, message, timestamp, count=1, title=None):
+    """Create or update a conversation's summary row inside the caller's transaction"""
+    summary = session.query(ConversationSummary)\
+                     .filter_by(user_id=user_id, id=conversation_id).first()
+    if summary is None:
+        summary = ConversationSummary(
+            user_id=user_id,
+            id=conversation_id,
+            title=title or message,
+            last_message=message,
+            last_timestamp=timestamp,
+            message_count=count
+        )
+        session.add(summary)
+    else:
+        if timestamp >= summary.last_timestamp:
+            summary.last_message = message
+            summary.last_timestamp = timestamp
+        summary.message_count = summary.message_count + count
+    return summary
+
+def add_turns(session, turns):
+    """Add whole chat turns to the caller's transaction.
+    
+    Each turn is a dict with user_id, conversation_id, user_message, bot_message and
+    timestamp, plus optional image_id, image (an unsaved reference from store_image),
+    html and html_version.
+    """
+    messages = []
+    for turn in turns:
+        user_id = turn['user_id']
+        conversation_id = turn['conversation_id']
+        timestamp = turn['timestamp']
+        
+        image = turn.get('image')
+        image_id = turn.get('image_id')
+        if image:
+            session.add(image_row(user_id, conversation_id, image, timestamp))
+            image_id = image['id']
         
-        new_message = Conversation(
+        messages.append(Conversation(
             id=str(uuid.uuid4()),
             user_id=user_id,
             conversation_id=conversation_id,
-            message=message,
-            is_bot=is_bot,
+            message=turn['user_message'],
+            is_bot=False,
             timestamp=timestamp,
             image_id=image_id
-        )
-        session.add(new_message)
+        ))
+        messages.append(Conversation(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message=turn['bot_message'],
+            is_bot=True,
+            timestamp=timestamp,
+            html=turn.get('html'),
+            html_version=turn.get('html_version')
+        ))
+        session.add_all(messages[-2:])
+        update_summary(session, user_id, conversation_id, turn['bot_message'], timestamp,
+                       count=2, title=turn['user_message'])
+    # Same transaction, so the index never has messages that weren't saved
+    if search_enabled():
+        index_messages(session, messages)
+    return messages
+
+def save_turns(turns):
+    """Save whole chat turns (see add_turns) in a single transaction"""
+    session = Session()
+    try:
+        add_turns(session, turns)
         session.commit()
         return True
     except Exception as e:
         session.rollback()
-        print(f"Database error: {str(e)}")
+        print(f"Database error saving turns: {str(e)}")
         return False
     finally:
         session.close()
 
-def save_image(user_id, conversation_id, image_data):
-    """Save an image to the database and return its ID"""
+def save_turn(user_id, conversation_id, user_message, bot_message, timestamp, image_id=None,
+              image=None, html=None, html_version=None):
+    """Save a user message, its image reference and the bot reply with one commit"""
+    return save_turns([{
+        'user_id': user_id,
+        'conversation_id': conversation_id,
+        'user_message': user_message,
+        'bot_message': bot_message,
+        'timestamp': timestamp,
+        'image_id': image_id,
+        'image': image,
+        'html': html,
+        'html_version': html_version
+    }])
+
+def store_image(image_bytes, mime_type='image/jpeg', thumb_bytes=None):
+    """Write an image (and its thumbnail) to the image store and return its not yet saved reference"""
+    return {
+        'id': str(uuid.uuid4()),
+        'sha256': image_store.put_bytes(image_bytes),
+        'thumb_sha256': image_store.put_bytes(thumb_bytes) if thumb_bytes else None,
+        'mime_type': mime_type,
+        'size': len(image_bytes)
+    }
+
+def image_row(user_id, conversation_id, image, timestamp):
+    """Build the Image row for a reference returned by store_image"""
+    return Image(
+        id=image['id'],
+        user_id=user_id,
+        conversation_id=conversation_id,
+        image_data='',
+        timestamp=timestamp,
+        sha256=image['sha256'],
+        mime_type=image['mime_type'],
+        size=image['size'],
+        thumb_sha256=image['thumb_sha256']
+    )
+
+def save_image(user_id, conversation_id, image_bytes, mime_type='image/jpeg', thumb_bytes=None):
+    """Write an image (and its thumbnail) to the image store, save a reference row and return its ID"""
+    image = store_image(image_bytes, mime_type, thumb_bytes)
     session = Session()
     try:
-        image_id = str(uuid.uuid4())
-        new_image = Image(
-            id=image_id,
-            user_id=user_id,
-            conversation_id=conversation_id,
-            image_data=image_data,
-            timestamp=datetime.now()
-        )
-        session.add(new_image)
+        session.add(image_row(user_id, conversation_id, image, datetime.now()))
         session.commit()
-        return image_id
+        return image['id']
     except Exception as e:
         session.rollback()
         print(f"Database error saving image: {str(e)}")
@@ -139,74 +287,292 @@ def save_image(user_id, conversation_id, image_data):
     finally:
         session.close()
 
+def move_image_to_store(image, thumbnail=False):
+    """Move a legacy base64 image row into the image store (the caller commits)"""
+    image_bytes = base64.b64decode(image.image_data)
+    image.sha256 = image_store.put_bytes(image_bytes)
+    image.size = len(image_bytes)
+    # Legacy rows have no type, or whatever the data URL claimed
+    image.mime_type = detect_mime_type(image_bytes) or image.mime_type or 'image/jpeg'
+    if thumbnail and not image.thumb_sha256:
+        try:
+            thumb_bytes = make_thumbnail(image_bytes)
+            if thumb_bytes:
+                image.thumb_sha256 = image_store.put_bytes(thumb_bytes)
+        except Exception as e:
+            # The image is still moved, it's just served full size in place of a thumbnail
+            print(f"No thumbnail for image {image.id}: {str(e)}")
+    image.image_data = ''
+
 def get_image_by_id(image_id):
-    """Get image data by ID"""
+    """Get an image's store path and metadata by ID, moving legacy rows to the store on first read"""
     session = Session()
     try:
         image = session.query(Image).filter_by(id=image_id).first()
-        if image:
-            return image.image_data
-        return None
+        if not image:
+            return None
+        
+        if not image.sha256:
+            move_image_to_store(image)
+            session.commit()
+        
+        return {
+            "id": image.id,
+            "user_id": image.user_id,
+            "conversation_id": image.conversation_id,
+            "path": image_store.path_for(image.sha256),
+            "sha256": image.sha256,
+            "mime_type": image.mime_type or 'image/jpeg',
+            "size": image.size,
+            "thumb_path": image_store.path_for(image.thumb_sha256) if image.thumb_sha256 else None,
+            "thumb_sha256": image.thumb_sha256,
+            "timestamp": image.timestamp
+        }
+    except Exception as e:
+        session.rollback()
+        print(f"Error in get_image_by_id: {str(e)}")
+        raise
     finally:
         session.close()
 
-def get_user_conversations(user_id, conversation_id=None):
-    """Get conversations for a user, optionally filtered by conversation ID"""
+def migrate_images_to_store(batch_size=100):
+    """Move every legacy base64 image into the image store, with a thumbnail. Returns the count.
+    
+    IDs are paged `batch_size` per transaction and the blobs loaded one at a time, so only
+    one image is held in memory however large the batch.
+    """
+    migrated = 0
+    last_id = ''
+    while True:
+        session = Session()
+        try:
+            image_ids = [row.id for row in session.query(Image.id)
+                                                  .filter(Image.sha256.is_(None), Image.id > last_id)
+                                                  .order_by(Image.id).limit(batch_size)]
+            if not image_ids:
+                return migrated
+            
+            for image_id in image_ids:
+                image = session.get(Image, image_id)
+                try:
+                    move_image_to_store(image, thumbnail=True)
+                except Exception as e:
+                    print(f"Error migrating image {image_id}: {str(e)}")
+                    session.expunge(image)
+                    continue
+                # Write the row and let go of the blob before loading the next one
+                session.flush()
+                session.expunge(image)
+                migrated += 1
+            last_id = image_ids[-1]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+def vacuum_database():
+    """Reclaim space left behind by large deletes or updates"""
+    with get_engine().connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+def get_db_stats():
+    """Connection pool and query timing counters for this process"""
+    return engine_stats(get_engine())
+
+def get_recent_messages(user_id, conversation_id, limit):
+    """Get the last `limit` messages of a conversation as (is_bot, message, timestamp) tuples, oldest first"""
     session = Session()
     try:
-        query = session.query(Conversation).filter_by(user_id=user_id)
+        rows = session.query(Conversation.is_bot, Conversation.message, Conversation.timestamp)\
+                      .filter_by(user_id=user_id, conversation_id=conversation_id)\
+                      .order_by(Conversation.timestamp.desc(), Conversation.is_bot.desc())\
+                      .limit(limit).all()
         
-        if conversation_id:
-            # Get messages for a specific conversation
-            messages = query.filter_by(conversation_id=conversation_id)\
-                         .order_by(Conversation.timestamp).all()
-            
-            # Check if image_id column exists in the result
-            has_image_id = hasattr(messages[0], 'image_id') if messages else False
-            
-            result = []
-            for msg in messages:
-                message_dict = {
-                    "message": msg.message,
-                    "is_bot": msg.is_bot,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-                
-                # Add image_id if the column exists
-                if has_image_id:
-                    message_dict["image_id"] = msg.image_id
-                    
-                result.append(message_dict)
-        else:
-            # Get all conversations for the user
-            conversations = {}
-            for msg in query.order_by(Conversation.timestamp).all():
-                if msg.conversation_id not in conversations:
-                    conversations[msg.conversation_id] = {
-                        "id": msg.conversation_id,
-                        "last_message": msg.message,
-                        "timestamp": msg.timestamp.isoformat(),
-                        "messages": []
-                    }
-                
-                message_dict = {
-                    "message": msg.message,
-                    "is_bot": msg.is_bot,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-                
-                # Add image_id if the column exists
-                if hasattr(msg, 'image_id'):
-                    message_dict["image_id"] = msg.image_id
-                
-                conversations[msg.conversation_id]["messages"].append(message_dict)
-            
-            result = list(conversations.values())
+        # Rows come newest first from the index, flip them back to chat order
+        return [(row.is_bot, row.message, row.timestamp) for row in reversed(rows)]
+    except Exception as e:
+        print(f"Error in get_recent_messages: {str(e)}")
+        return []
+    finally:
+        session.close()
+
+def get_messages_between(user_id, conversation_id, after, before, limit):
+    """Get up to `limit` messages with after < timestamp < before as (is_bot, message, timestamp), oldest first"""
+    session = Session()
+    try:
+        query = session.query(Conversation.is_bot, Conversation.message, Conversation.timestamp)\
+                       .filter_by(user_id=user_id, conversation_id=conversation_id)\
+                       .filter(Conversation.timestamp < before)
+        if after is not None:
+            query = query.filter(Conversation.timestamp > after)
+        rows = query.order_by(Conversation.timestamp, Conversation.is_bot).limit(limit).all()
+        return [(row.is_bot, row.message, row.timestamp) for row in rows]
+    except Exception as e:
+        print(f"Error in get_messages_between: {str(e)}")
+        return []
+    finally:
+        session.close()
+
+def get_context_summary(user_id, conversation_id):
+    """Get a conversation's rolling summary as (summary, summarized_until), (None, None) if there is none"""
+    session = Session()
+    try:
+        row = session.query(ConversationSummary.context_summary, ConversationSummary.summarized_until)\
+                     .filter_by(user_id=user_id, id=conversation_id).first()
+        if row is None:
+            return None, None
+        return row.context_summary, row.summarized_until
+    except Exception as e:
+        print(f"Error in get_context_summary: {str(e)}")
+        return None, None
+    finally:
+        session.close()
+
+def save_context_summary(user_id, conversation_id, summary, summarized_until):
+    """Store an updated rolling summary, unless a newer one was saved in the meantime"""
+    session = Session()
+    try:
+        row = session.query(ConversationSummary).filter_by(user_id=user_id, id=conversation_id).first()
+        if row is None:
+            return False
+        if row.summarized_until is not None and row.summarized_until >= summarized_until:
+            return False
+        row.context_summary = summary
+        row.summarized_until = summarized_until
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"Database error saving context summary: {str(e)}")
+        return False
+    finally:
+        session.close()
+
+def get_history_state(user_id):
+    """Newest last_timestamp, number of conversations and of messages of a user, for the history's cache validator.
+    
+    Reads only the user's summary rows, never their messages.
+    """
+    session = Session()
+    try:
+        last_timestamp, count, messages = session.query(func.max(ConversationSummary.last_timestamp),
+                                                        func.count(ConversationSummary.id),
+                                                        func.sum(ConversationSummary.message_count))\
+                                                 .filter(ConversationSummary.user_id == user_id).one()
+        return {"last_timestamp": last_timestamp, "count": count, "messages": messages or 0}
+    finally:
+        session.close()
+
+def get_conversation_state(user_id, conversation_id):
+    """Last message time and message count of one conversation, or None if it doesn't exist"""
+    session = Session()
+    try:
+        row = session.query(ConversationSummary.last_timestamp, ConversationSummary.message_count)\
+                     .filter_by(user_id=user_id, id=conversation_id).first()
+        if row is None:
+            return None
+        return {"last_timestamp": row.last_timestamp, "message_count": row.message_count}
+    finally:
+        session.close()
+
+def get_conversation_summaries(user_id, limit, before=None, since=None):
+    """Get up to `limit` conversation summaries for a user, newest first.
+    
+    `before` is the (last_timestamp, id) of the last summary on the previous page.
+    `since` limits the result to conversations with a message after that time.
+    """
+    session = Session()
+    try:
+        query = session.query(ConversationSummary).filter_by(user_id=user_id)
+        
+        if since:
+            query = query.filter(ConversationSummary.last_timestamp > since)
+        if before:
+            before_timestamp, before_id = before
+            query = query.filter(or_(
+                ConversationSummary.last_timestamp < before_timestamp,
+                and_(ConversationSummary.last_timestamp == before_timestamp,
+                     ConversationSummary.id < before_id)
+            ))
+        
+        summaries = query.order_by(ConversationSummary.last_timestamp.desc(),
+                                   ConversationSummary.id.desc())\
+                         .limit(limit).all()
+        
+        return [{
+            "id": summary.id,
+            "title": summary.title,
+            "last_message": summary.last_message,
+            "timestamp": summary.last_timestamp.isoformat(),
+            "message_count": summary.message_count
+        } for summary in summaries]
+    except Exception as e:
+        print(f"Error in get_conversation_summaries: {str(e)}")
+        return []
+    finally:
+        session.close()
+
+def search_conversations(user_id, query, limit, offset=0):
+    """Search a user's messages, best matches first, with HTML-escaped snippets"""
+    session = Session()
+    try:
+        if search_enabled():
+            return search_messages(session, user_id, query, limit, offset)
+        
+        # No FTS5: every word must appear somewhere in the message, newest first
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        results = session.query(Conversation, ConversationSummary.title)\
+                         .outerjoin(ConversationSummary, and_(ConversationSummary.user_id == Conversation.user_id,
+                                                              ConversationSummary.id == Conversation.conversation_id))\
+                         .filter(Conversation.user_id == user_id)
+        for word in words:
+            escaped = word.replace('\\', '\\\\').replace('_', '\\_')
+            results = results.filter(Conversation.message.ilike(f"%{escaped}%", escape='\\'))
+        results = results.order_by(Conversation.timestamp.desc()).offset(offset).limit(limit).all()
+        
+        return [{
+            "message_id": msg.id,
+            "conversation_id": msg.conversation_id,
+            "title": title,
+            "is_bot": msg.is_bot,
+            "timestamp": msg.timestamp.isoformat(),
+            "snippet": like_snippet(msg.message, words)
+        } for msg, title in results]
+    except Exception as e:
+        print(f"Error in search_conversations: {str(e)}")
+        return []
+    finally:
+        session.close()
+
+def backfill_search(batch_size=5000):
+    """Index messages saved before the search index existed. Returns the number indexed."""
+    if not search_enabled():
+        return 0
+    return backfill_search_index(get_engine(), batch_size)
+
+def get_user_conversations(user_id, conversation_id):
+    """Get the messages of one of a user's conversations, oldest first"""
+    session = Session()
+    try:
+        messages = session.query(Conversation)\
+                          .filter_by(user_id=user_id, conversation_id=conversation_id)\
+                          .order_by(Conversation.timestamp).all()
         
-        return result
+        return [{
+            "id": msg.id,
+            "message": msg.message,
+            "html": msg.html,
+            "html_version": msg.html_version,
+            "is_bot": msg.is_bot,
+            "timestamp": msg.timestamp.isoformat(),
+            "image_id": msg.image_id
+        } for msg in messages]
     except Exception as e:
         print(f"Error in get_user_conversations: {str(e)}")
-        # Return empty result on error
-        return [] if conversation_id is None else []
+        return []
     finally:
         session.close()
\ No newline at end of file
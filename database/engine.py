@@ -0,0 +1,144 @@
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+class EngineStats:
+    """Counters for pool checkouts and query timings, shared by every connection of an engine"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.queries = 0
+        self.query_time_total = 0.0
+        self.query_time_max = 0.0
+        self.slow_queries = 0
+    
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+    
+    def record_query(self, seconds, slow):
+        with self._lock:
+            self.queries += 1
+            self.query_time_total += seconds
+            self.query_time_max = max(self.query_time_max, seconds)
+            if slow:
+                self.slow_queries += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_wait_total": self.checkout_wait_total,
+                "checkout_wait_max": self.checkout_wait_max,
+                "queries": self.queries,
+                "query_time_total": self.query_time_total,
+                "query_time_max": self.query_time_max,
+                "slow_queries": self.slow_queries
+            }
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection"""
+    
+    stats = None
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.record_checkout(time.perf_counter() - start)
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+def is_sqlite_memory(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+def create_configured_engine(config):
+    """Create the engine with a pool suited to the backend, SQLite pragmas and timing hooks"""
+    uri = config.DATABASE_URI
+    stats = EngineStats()
+    
+    if is_sqlite_memory(uri):
+        # Every connection to :memory: is a new empty database, so share a single one
+        engine = create_engine(uri, poolclass=StaticPool,
+                               connect_args={'check_same_thread': False})
+    else:
+        pool_class = type('BoundTimedQueuePool', (TimedQueuePool,), {'stats': stats})
+        options = {
+            'poolclass': pool_class,
+            'pool_size': config.DB_POOL_SIZE,
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'pool_timeout': config.DB_POOL_TIMEOUT,
+        }
+        if is_sqlite(uri):
+            # Pooled connections move between request threads
+            options['connect_args'] = {'check_same_thread': False}
+        else:
+            options['pool_pre_ping'] = True
+            options['pool_recycle'] = config.DB_POOL_RECYCLE
+        engine = create_engine(uri, **options)
+    
+    engine.stats = stats
+    
+    if is_sqlite(uri):
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                # WAL lets readers run alongside the single writer
+                if not is_sqlite_memory(uri):
+                    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+                    cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+                # NORMAL only fsyncs at checkpoints in WAL mode, still safe against corruption
+                cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+                # Wait for the write lock instead of failing with "database is locked"
+                cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+                # Negative cache_size is in KiB rather than pages
+                cursor.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_SIZE_KB)}")
+                cursor.execute("PRAGMA temp_store=MEMORY")
+            finally:
+                cursor.close()
+    
+    slow_query_seconds = config.DB_SLOW_QUERY_MS / 1000.0
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+        slow = elapsed >= slow_query_seconds
+        stats.record_query(elapsed, slow)
+        if slow:
+            print(f"Slow query ({elapsed * 1000:.1f} ms): {statement[:200]}")
+    
+    @event.listens_for(engine, 'handle_error')
+    def drop_query_timer(context):
+        # after_cursor_execute doesn't run for failed statements, so their start times would pile up
+        conn = context.connection
+        if conn is not None and conn.info.get('query_start_time'):
+            conn.info['query_start_time'].pop()
+    
+    return engine
+
+def engine_stats(engine):
+    """Pool state and timing counters for an engine created by create_configured_engine"""
+    stats = engine.stats.snapshot()
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "pool_size": pool.size(),
+            "pool_checked_out": pool.checkedout(),
+            "pool_overflow": pool.overflow(),
+            "pool_idle": pool.checkedin()
+        })
+    return stats
@@ -0,0 +1,242 @@
+"""Streaming export of messages joined to their image metadata, as NDJSON or Parquet.
+
+Rows are read in keyset pages over the primary key, each page in its own
+transaction, so memory stays flat and a long export never holds one read
+transaction open on the live database (which would stop SQLite's WAL from being
+checkpointed). The id of the last exported row is the checkpoint to resume from.
+"""
+import json
+import os
+from database.db_handler import Session, Conversation, Image
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+FORMATS = ('ndjson', 'parquet')
+
+# Column order of every export; image columns are null for messages without an image
+COLUMNS = ('id', 'user_id', 'conversation_id', 'is_bot', 'timestamp', 'message',
+           'image_id', 'image_sha256', 'image_mime_type', 'image_size', 'image_timestamp')
+
+def parquet_schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('user_id', pa.string()),
+        ('conversation_id', pa.string()),
+        ('is_bot', pa.bool_()),
+        ('timestamp', pa.timestamp('us')),
+        ('message', pa.string()),
+        ('image_id', pa.string()),
+        ('image_sha256', pa.string()),
+        ('image_mime_type', pa.string()),
+        ('image_size', pa.int64()),
+        ('image_timestamp', pa.timestamp('us')),
+    ])
+
+def check_format(export_format):
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format == 'parquet' and pa is None:
+        raise ValueError("Parquet export needs pyarrow, install it with `pip install pyarrow`")
+
+def iter_batches(user_id=None, since=None, until=None, after=None, page_size=10000, batch_size=1000):
+    """Yield lists of up to `batch_size` row dicts ordered by message id, starting after the id `after`"""
+    while True:
+        exported = 0
+        session = Session()
+        try:
+            # Only the columns we export; the legacy base64 image_data is never loaded
+            query = session.query(
+                Conversation.id, Conversation.user_id, Conversation.conversation_id, Conversation.is_bot,
+                Conversation.timestamp, Conversation.message,
+                Image.id.label('image_id'), Image.sha256, Image.mime_type, Image.size,
+                Image.timestamp.label('image_timestamp')
+            ).outerjoin(Image, Image.id == Conversation.image_id)
+            
+            if user_id:
+                query = query.filter(Conversation.user_id == user_id)
+            if since:
+                query = query.filter(Conversation.timestamp >= since)
+            if until:
+                query = query.filter(Conversation.timestamp < until)
+            if after:
+                query = query.filter(Conversation.id > after)
+            
+            # Server-side cursor where the driver supports it, fetched batch_size rows at a time
+            query = query.order_by(Conversation.id).limit(page_size)\
+                         .execution_options(stream_results=True).yield_per(batch_size)
+            
+            batch = []
+            for row in query:
+                batch.append({
+                    'id': row.id,
+                    'user_id': row.user_id,
+                    'conversation_id': row.conversation_id,
+                    'is_bot': bool(row.is_bot),
+                    'timestamp': row.timestamp,
+                    'message': row.message,
+                    'image_id': row.image_id,
+                    'image_sha256': row.sha256,
+                    'image_mime_type': row.mime_type,
+                    'image_size': row.size,
+                    'image_timestamp': row.image_timestamp,
+                })
+                if len(batch) == batch_size:
+                    exported += len(batch)
+                    after = batch[-1]['id']
+                    yield batch
+                    batch = []
+            if batch:
+                exported += len(batch)
+                after = batch[-1]['id']
+                yield batch
+        finally:
+            session.close()
+        
+        # A short page is the last one; otherwise carry on after it in a new transaction
+        if exported < page_size:
+            return
+
+def ndjson_chunk(batch):
+    lines = []
+    for row in batch:
+        values = dict(row)
+        for key in ('timestamp', 'image_timestamp'):
+            if values[key] is not None:
+                values[key] = values[key].isoformat()
+        lines.append(json.dumps(values, ensure_ascii=False) + '\n')
+    return ''.join(lines).encode('utf-8')
+
+def parquet_table(batch):
+    columns = {name: [row[name] for row in batch] for name in COLUMNS}
+    return pa.Table.from_pydict(columns, schema=parquet_schema())
+
+class ChunkSink:
+    """Write-only file object that hands back whatever was written since the last call"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def parquet_chunks(batches):
+    """Encode batches as a single Parquet file, one row group per batch, without buffering the whole file"""
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), parquet_schema(), compression='zstd')
+    for batch in batches:
+        writer.write_table(parquet_table(batch))
+        data = sink.take()
+        if data:
+            yield data
+    # The footer is written on close
+    writer.close()
+    yield sink.take()
+
+def export_chunks(export_format, user_id=None, since=None, until=None, after=None, page_size=10000, batch_size=1000):
+    """Bytes of an export, for streaming as an HTTP response"""
+    check_format(export_format)
+    batches = iter_batches(user_id, since, until, after, page_size, batch_size)
+    if export_format == 'parquet':
+        return parquet_chunks(batches)
+    return (ndjson_chunk(batch) for batch in batches)
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def write_checkpoint(path, checkpoint):
+    if not path:
+        return
+    # Write then rename, so a crash never leaves a half-written checkpoint
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, path)
+
+def export_to_path(output, export_format='ndjson', checkpoint_path=None, user_id=None, since=None, until=None,
+                   page_size=10000, batch_size=1000, rows_per_part=1000000):
+    """Export to a file (NDJSON) or a directory of part files (Parquet), resuming from the checkpoint if there is one.
+    
+    Returns the total number of rows exported, including those of earlier runs.
+    """
+    check_format(export_format)
+    filters = {'user_id': user_id,
+               'since': since.isoformat() if since else None,
+               'until': until.isoformat() if until else None}
+    
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint is not None and (checkpoint['format'] != export_format or checkpoint['filters'] != filters):
+        raise ValueError("The checkpoint belongs to an export with a different format or filters")
+    if checkpoint is None:
+        checkpoint = {'format': export_format, 'filters': filters, 'after': None, 'rows': 0, 'bytes': 0, 'parts': 0}
+    
+    batches = iter_batches(user_id, since, until, checkpoint['after'], page_size, batch_size)
+    if export_format == 'ndjson':
+        export_ndjson(output, batches, checkpoint, checkpoint_path)
+    else:
+        export_parquet(output, batches, checkpoint, checkpoint_path, rows_per_part)
+    return checkpoint['rows']
+
+def export_ndjson(output, batches, checkpoint, checkpoint_path):
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    mode = 'r+b' if checkpoint['bytes'] and os.path.exists(output) else 'wb'
+    with open(output, mode) as output_file:
+        # Drop lines written after the last checkpoint by an interrupted run
+        output_file.seek(checkpoint['bytes'])
+        output_file.truncate()
+        for batch in batches:
+            output_file.write(ndjson_chunk(batch))
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            checkpoint.update(after=batch[-1]['id'], rows=checkpoint['rows'] + len(batch),
+                              bytes=output_file.tell())
+            write_checkpoint(checkpoint_path, checkpoint)
+
+def export_parquet(output, batches, checkpoint, checkpoint_path, rows_per_part):
+    """Parquet files can't be appended to, so each part is checkpointed once it's closed"""
+    os.makedirs(output, exist_ok=True)
+    writer = None
+    part_rows = 0
+    part_after = checkpoint['after']
+    for batch in batches:
+        if writer is None:
+            # An interrupted run's unfinished part has the same number and is overwritten
+            part_path = os.path.join(output, f"part-{checkpoint['parts']:05d}.parquet")
+            writer = pq.ParquetWriter(part_path, parquet_schema(), compression='zstd')
+        writer.write_table(parquet_table(batch))
+        part_rows += len(batch)
+        part_after = batch[-1]['id']
+        if part_rows >= rows_per_part:
+            writer.close()
+            writer = None
+            checkpoint.update(after=part_after, rows=checkpoint['rows'] + part_rows, parts=checkpoint['parts'] + 1)
+            write_checkpoint(checkpoint_path, checkpoint)
+            part_rows = 0
+    if writer is not None:
+        writer.close()
+        checkpoint.update(after=part_after, rows=checkpoint['rows'] + part_rows, parts=checkpoint['parts'] + 1)
+        write_checkpoint(checkpoint_path, checkpoint)
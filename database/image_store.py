@@ -0,0 +1,71 @@
+import hashlib
+import os
+import tempfile
+from config import Config
+
+class ImageTooLarge(Exception):
+    """Raised when a streamed upload goes over the configured size cap"""
+
+class ImageStore:
+    """Content-addressed blob store: each image is written once under its SHA-256"""
+    
+    def __init__(self, root):
+        self.root = root
+    
+    def path_for(self, digest):
+        """Get the file path for a digest, fanned out into two directory levels"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+    
+    def put_bytes(self, data):
+        """Store raw image bytes and return their SHA-256, skipping the write for duplicates"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return digest
+        
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        
+        # Write to a temp file and rename so readers never see a partial image
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+    
+    def receive_stream(self, stream, max_bytes=None, chunk_size=64 * 1024):
+        """Copy a file-like object to a temp file in the store in chunks, hashing as it goes.
+        
+        Returns (temp_path, digest, size). Raises ImageTooLarge once more than `max_bytes` are read.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ImageTooLarge(f"Image is larger than {max_bytes} bytes")
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+            return temp_path, hasher.hexdigest(), size
+        except Exception:
+            os.remove(temp_path)
+            raise
+    
+    def read_bytes(self, digest):
+        with open(self.path_for(digest), 'rb') as image_file:
+            return image_file.read()
+
+image_store = ImageStore(Config.IMAGE_STORE_DIR)
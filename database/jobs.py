@@ -0,0 +1,262 @@
+"""Persistent queue of batch diagnosis jobs, stored in the main database.
+
+Workers claim one item at a time with a conditional UPDATE, so any number of
+threads or processes can share the queue. A claimed item carries a lease; if
+its worker dies, the item is claimed again once the lease runs out.
+"""
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from database.db_handler import Session, Job, JobItem, add_turns
+
+def create_job(user_id, conversation_id, prompt, images):
+    """Queue a job for images already written to the image store.
+    
+    `images` are references from store_image, each with an added `filename`. Returns the job as a dict.
+    """
+    session = Session()
+    try:
+        now = datetime.now()
+        job = Job(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            conversation_id=conversation_id,
+            prompt=prompt or None,
+            status='queued',
+            total=len(images),
+            completed=0,
+            failed=0,
+            created_at=now,
+            updated_at=now
+        )
+        session.add(job)
+        session.add_all([JobItem(
+            id=str(uuid.uuid4()),
+            job_id=job.id,
+            position=position,
+            filename=image.get('filename'),
+            status='queued',
+            attempts=0,
+            next_attempt_at=now,
+            image_id=image['id'],
+            sha256=image['sha256'],
+            mime_type=image['mime_type'],
+            size=image['size'],
+            thumb_sha256=image['thumb_sha256'],
+            updated_at=now
+        ) for position, image in enumerate(images)])
+        session.commit()
+        return job_dict(job)
+    except Exception as e:
+        session.rollback()
+        print(f"Database error creating job: {str(e)}")
+        raise
+    finally:
+        session.close()
+
+def claim_item(lease_seconds, max_attempts):
+    """Take the next runnable item, or None. Returns a dict with the item and its job's user, conversation and prompt.
+    
+    Every claim counts as an attempt. An item whose worker died on its last attempt is
+    marked failed instead of being claimed again, so an image that crashes workers can't loop.
+    """
+    session = Session()
+    try:
+        now = datetime.now()
+        runnable = or_(
+            and_(JobItem.status == 'queued', JobItem.next_attempt_at <= now),
+            # A worker died holding it
+            and_(JobItem.status == 'running', JobItem.locked_until < now)
+        )
+        # A few candidates, in case other workers claim the first ones first
+        candidates = session.query(JobItem.id, JobItem.status, JobItem.attempts)\
+                            .filter(runnable)\
+                            .order_by(JobItem.position, JobItem.next_attempt_at)\
+                            .limit(5).all()
+        
+        for item_id, status, attempts in candidates:
+            # Only succeeds if nobody claimed the item since we read it
+            claimed = session.query(JobItem)\
+                             .filter(JobItem.id == item_id, JobItem.status == status, JobItem.attempts == attempts)\
+                             .update({
+                                 'status': 'running',
+                                 'attempts': attempts + 1,
+                                 'locked_until': now + timedelta(seconds=lease_seconds),
+                                 'updated_at': now
+                             }, synchronize_session=False)
+            if not claimed:
+                continue
+            
+            item = session.query(JobItem).filter_by(id=item_id).one()
+            if status == 'running' and attempts >= max_attempts:
+                item.status = 'failed'
+                item.attempts = attempts
+                item.error = 'The worker stopped while running this item'
+                item.locked_until = None
+                finish_job_item(session, item, 'failed', now)
+                session.commit()
+                continue
+            
+            job = session.query(Job).filter_by(id=item.job_id).one()
+            if job.status == 'queued':
+                job.status = 'running'
+                job.updated_at = now
+            session.commit()
+            return dict(item_dict(item), user_id=job.user_id, conversation_id=job.conversation_id,
+                        prompt=job.prompt)
+        session.commit()
+        return None
+    except Exception as e:
+        session.rollback()
+        print(f"Database error claiming job item: {str(e)}")
+        return None
+    finally:
+        session.close()
+
+def finish_job_item(session, item, status, now):
+    """Update the item's job counters and mark the job done after its last item"""
+    job = session.query(Job).filter_by(id=item.job_id).one()
+    if status == 'done':
+        job.completed = job.completed + 1
+    else:
+        job.failed = job.failed + 1
+    if job.completed + job.failed >= job.total:
+        job.status = 'done'
+    job.updated_at = now
+
+def complete_item(item, bot_response, html_response, html_version, user_message):
+    """Save the item's result as a turn of the job's conversation, in the same transaction as the item update"""
+    session = Session()
+    try:
+        now = datetime.now()
+        row = session.query(JobItem).filter_by(id=item['id'], attempts=item['attempts'], status='running').first()
+        if row is None:
+            # The lease ran out and another worker took over; its result wins
+            return False
+        
+        add_turns(session, [{
+            'user_id': item['user_id'],
+            'conversation_id': item['conversation_id'],
+            'user_message': user_message,
+            'bot_message': bot_response,
+            'timestamp': now,
+            'image': {
+                'id': row.image_id,
+                'sha256': row.sha256,
+                'mime_type': row.mime_type,
+                'size': row.size,
+                'thumb_sha256': row.thumb_sha256
+            },
+            'html': html_response,
+            'html_version': html_version
+        }])
+        row.status = 'done'
+        row.result = bot_response
+        row.error = None
+        row.locked_until = None
+        row.updated_at = now
+        finish_job_item(session, row, 'done', now)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print(f"Database error completing job item: {str(e)}")
+        raise
+    finally:
+        session.close()
+
+def fail_item(item, error, retry_delay=None):
+    """Queue the item again after `retry_delay` seconds, or mark it failed when that's None"""
+    session = Session()
+    try:
+        now = datetime.now()
+        row = session.query(JobItem).filter_by(id=item['id'], attempts=item['attempts'], status='running').first()
+        if row is None:
+            return
+        row.error = error
+        row.locked_until = None
+        row.updated_at = now
+        if retry_delay is not None:
+            row.status = 'queued'
+            row.next_attempt_at = now + timedelta(seconds=retry_delay)
+        else:
+            row.status = 'failed'
+            finish_job_item(session, row, 'failed', now)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Database error failing job item: {str(e)}")
+    finally:
+        session.close()
+
+def release_item(item, delay):
+    """Put a claimed item back in the queue after `delay` seconds without counting the attempt"""
+    session = Session()
+    try:
+        now = datetime.now()
+        session.query(JobItem)\
+               .filter_by(id=item['id'], attempts=item['attempts'], status='running')\
+               .update({
+                   'status': 'queued',
+                   'attempts': item['attempts'] - 1,
+                   'next_attempt_at': now + timedelta(seconds=delay),
+                   'locked_until': None,
+                   'updated_at': now
+               }, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Database error releasing job item: {str(e)}")
+    finally:
+        session.close()
+
+def get_job(user_id, job_id):
+    """A user's job with its progress counters, or None"""
+    session = Session()
+    try:
+        job = session.query(Job).filter_by(id=job_id, user_id=user_id).first()
+        return job_dict(job) if job else None
+    finally:
+        session.close()
+
+def get_job_items(user_id, job_id, after=-1, limit=100):
+    """Items of a user's job in upload order, starting after position `after`. None if the job isn't theirs."""
+    session = Session()
+    try:
+        if session.query(Job.id).filter_by(id=job_id, user_id=user_id).first() is None:
+            return None
+        items = session.query(JobItem)\
+                       .filter(JobItem.job_id == job_id, JobItem.position > after)\
+                       .order_by(JobItem.position).limit(limit).all()
+        return [item_dict(item) for item in items]
+    finally:
+        session.close()
+
+def job_dict(job):
+    return {
+        "id": job.id,
+        "conversation_id": job.conversation_id,
+        "prompt": job.prompt,
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "failed": job.failed,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat()
+    }
+
+def item_dict(item):
+    return {
+        "id": item.id,
+        "job_id": item.job_id,
+        "position": item.position,
+        "filename": item.filename,
+        "status": item.status,
+        "attempts": item.attempts,
+        "image_id": item.image_id,
+        "sha256": item.sha256,
+        "mime_type": item.mime_type,
+        "result": item.result,
+        "error": item.error,
+        "updated_at": item.updated_at.isoformat()
+    }
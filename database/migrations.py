@@ -0,0 +1,126 @@
+"""Versioned schema migrations, applied with `flask db-upgrade` before starting the app.
+
+Applied versions are recorded in `schema_migrations`, so workers never inspect the
+schema at startup. Every migration tolerates databases created by the old
+import-time setup, which lets existing deployments upgrade in place. Add new
+migrations at the end of MIGRATIONS with the next version; never edit one that
+has shipped.
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from database.db_handler import Base, Conversation, Image, ConversationSummary, Job, JobItem, get_engine
+from database.search import create_search_index, backfill_pending
+
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at DATETIME NOT NULL
+)
+"""
+
+def add_missing_columns(connection, table_name, columns):
+    """Add nullable columns (name -> SQL type) that an existing table doesn't have yet"""
+    inspector = inspect(connection)
+    if not inspector.has_table(table_name):
+        return
+    
+    existing = [col['name'] for col in inspector.get_columns(table_name)]
+    for name, sql_type in columns.items():
+        if name not in existing:
+            print(f"Adding {name} column to {table_name} table...")
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {sql_type}"))
+
+def create_tables(connection, models):
+    Base.metadata.create_all(connection, tables=[model.__table__ for model in models])
+    # create_all skips indexes on tables that already exist
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+def initial_schema(connection):
+    """Conversations, images and summaries, including columns added before migrations existed"""
+    summaries_exist = inspect(connection).has_table('conversation_summaries')
+    
+    add_missing_columns(connection, 'conversations', {
+        'image_id': 'VARCHAR',
+        'html': 'TEXT',
+        'html_version': 'INTEGER'
+    })
+    add_missing_columns(connection, 'images', {
+        'sha256': 'VARCHAR',
+        'mime_type': 'VARCHAR',
+        'size': 'INTEGER',
+        'thumb_sha256': 'VARCHAR'
+    })
+    create_tables(connection, [Conversation, Image, ConversationSummary])
+    
+    # Build summaries for conversations saved before the table existed
+    if not summaries_exist:
+        connection.execute(text("""
+        INSERT INTO conversation_summaries (user_id, id, title, last_message, last_timestamp, message_count)
+        SELECT c.user_id, c.conversation_id,
+            (SELECT f.message FROM conversations f
+             WHERE f.user_id = c.user_id AND f.conversation_id = c.conversation_id
+             ORDER BY f.timestamp, f.is_bot LIMIT 1),
+            (SELECT l.message FROM conversations l
+             WHERE l.user_id = c.user_id AND l.conversation_id = c.conversation_id
+             ORDER BY l.timestamp DESC, l.is_bot DESC LIMIT 1),
+            MAX(c.timestamp), COUNT(*)
+        FROM conversations c
+        GROUP BY c.user_id, c.conversation_id
+        """))
+
+def search_index(connection):
+    """FTS5 index over messages; skipped where SQLite lacks FTS5, and search falls back to LIKE"""
+    if not create_search_index(connection):
+        print("Full-text search unavailable, falling back to LIKE")
+
+def job_tables(connection):
+    create_tables(connection, [Job, JobItem])
+
+MIGRATIONS = [
+    (1, 'initial_schema', initial_schema),
+    (2, 'search_index', search_index),
+    (3, 'job_tables', job_tables),
+]
+
+def applied_versions(connection):
+    if not inspect(connection).has_table('schema_migrations'):
+        return set()
+    return {row.version for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending_migrations(engine=None):
+    """(version, name) of the migrations this database hasn't had yet"""
+    engine = engine or get_engine()
+    with engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+def upgrade(engine=None):
+    """Apply pending migrations in order, each in its own transaction. Returns the versions applied.
+    
+    SQLite commits some DDL implicitly, so a migration that fails halfway can leave part of
+    its changes behind; they're all idempotent, so fix the cause and run it again.
+    """
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_VERSION_TABLE))
+        applied = applied_versions(connection)
+    
+    upgraded = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {name}")
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(text(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"
+            ), {'version': version, 'name': name, 'applied_at': datetime.now()})
+        upgraded.append(version)
+    
+    if upgraded and engine.dialect.name == 'sqlite' and inspect(engine).has_table('search_index_state') \
+            and backfill_pending(engine):
+        print("Messages saved before search was added aren't indexed yet, run `flask search-backfill`")
+    return upgraded
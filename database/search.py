@@ -0,0 +1,207 @@
+import html
+import re
+from datetime import datetime
+from sqlalchemy import text
+
+# Standalone FTS5 table (not external content: VACUUM may renumber the rowids of
+# `conversations`, whose primary key is a string). user_id is an indexed column so
+# the per-user filter is an index lookup instead of a scan of every match. There are
+# no prefix indexes: FTS5 builds them for every indexed column, so they'd mostly hold
+# fragments of user IDs, and a prefix query is answered from a range of the term index.
+CREATE_FTS_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message,
+    user_id,
+    message_id UNINDEXED,
+    conversation_id UNINDEXED,
+    is_bot UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# Single row: the backfill covers messages older than `cutoff`, newer ones are indexed on insert
+CREATE_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS search_index_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    cutoff DATETIME NOT NULL,
+    cursor VARCHAR,
+    done BOOLEAN NOT NULL DEFAULT 0
+)
+"""
+
+INSERT_MESSAGE = text("""
+INSERT INTO messages_fts (message, user_id, message_id, conversation_id, is_bot, timestamp)
+VALUES (:message, :user_id, :message_id, :conversation_id, :is_bot, :timestamp)
+""")
+
+# Snippet markers that can't appear in user text, swapped for <mark> after escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+def fts5_available(connection):
+    return connection.dialect.name == 'sqlite' and \
+        bool(connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+def create_search_index(connection):
+    """Create the FTS5 table. Returns False when SQLite wasn't built with FTS5 or the database isn't SQLite."""
+    if not fts5_available(connection):
+        return False
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    )).first() is not None
+    connection.execute(text(CREATE_FTS_TABLE))
+    connection.execute(text(CREATE_STATE_TABLE))
+    if not exists:
+        # Messages saved from now on are indexed as they're written
+        connection.execute(text("DELETE FROM search_index_state"))
+        # Same text format SQLAlchemy uses for DateTime columns on SQLite, so comparisons work
+        connection.execute(text("INSERT INTO search_index_state (id, cutoff, done) VALUES (1, :cutoff, 0)"),
+                           {'cutoff': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')})
+        # Rank on the message text only; user_id is just a filter
+        connection.execute(text("INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"))
+    return True
+
+def has_search_index(engine):
+    """Whether the migrations created the FTS5 table in this database"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            )).first() is not None
+    except Exception as e:
+        print(f"Full-text search unavailable, falling back to LIKE: {str(e)}")
+        return False
+
+def index_messages(session, messages):
+    """Add Conversation rows to the index inside the caller's transaction"""
+    if not messages:
+        return
+    session.execute(INSERT_MESSAGE, [{
+        'message': msg.message,
+        'user_id': msg.user_id,
+        'message_id': msg.id,
+        'conversation_id': msg.conversation_id,
+        'is_bot': 1 if msg.is_bot else 0,
+        'timestamp': msg.timestamp.isoformat()
+    } for msg in messages])
+
+def backfill_search_index(engine, batch_size=5000):
+    """Index messages saved before the FTS table existed, a batch per transaction.
+    
+    Resumes from the last committed batch if interrupted. Returns the number of messages indexed.
+    """
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            state = connection.execute(text("SELECT cutoff, cursor, done FROM search_index_state WHERE id = 1")).first()
+            if state is None or state.done:
+                return total
+            
+            # Keyset over the primary key, so each batch is an index range scan
+            rows = connection.execute(text("""
+                SELECT id, message, user_id, conversation_id, is_bot, timestamp FROM conversations
+                WHERE id > :cursor AND timestamp < :cutoff
+                ORDER BY id LIMIT :limit
+            """), {'cursor': state.cursor or '', 'cutoff': state.cutoff, 'limit': batch_size}).fetchall()
+            
+            if rows:
+                connection.execute(INSERT_MESSAGE, [{
+                    'message': row.message,
+                    'user_id': row.user_id,
+                    'message_id': row.id,
+                    'conversation_id': row.conversation_id,
+                    'is_bot': 1 if row.is_bot else 0,
+                    'timestamp': str(row.timestamp)
+                } for row in rows])
+            connection.execute(text("UPDATE search_index_state SET cursor = :cursor, done = :done WHERE id = 1"),
+                               {'cursor': rows[-1].id if rows else state.cursor, 'done': len(rows) < batch_size})
+        total += len(rows)
+        if rows:
+            print(f"Indexed {total} messages")
+
+def backfill_pending(engine):
+    """Whether there are messages from before the index existed that the backfill hasn't indexed yet"""
+    with engine.connect() as connection:
+        state = connection.execute(text("SELECT cutoff, cursor, done FROM search_index_state WHERE id = 1")).first()
+        if state is None or state.done:
+            return False
+        return connection.execute(text(
+            "SELECT 1 FROM conversations WHERE id > :cursor AND timestamp < :cutoff LIMIT 1"
+        ), {'cursor': state.cursor or '', 'cutoff': state.cutoff}).first() is not None
+
+def match_query(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix.
+    
+    Quoting each word keeps FTS5 operators and punctuation in user input from being parsed.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' AND '.join(terms)
+
+def user_filter(user_id):
+    """Column filter narrowing a match to one user's messages through the index.
+    
+    Punctuation is dropped, so callers also compare user_id exactly.
+    """
+    words = re.findall(r'\w+', user_id)
+    return 'user_id : "' + ' '.join(words) + '"'
+
+def render_snippet(snippet):
+    """Escape a snippet and turn the match markers into <mark> tags"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def like_snippet(message, words, width=80):
+    """Snippet around the first matching word, for the LIKE fallback"""
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    first = pattern.search(message)
+    start = max(0, first.start() - width) if first else 0
+    excerpt = message[start:start + 2 * width]
+    excerpt = pattern.sub(lambda m: MARK_START + m.group(0) + MARK_END, excerpt)
+    if start > 0:
+        excerpt = '…' + excerpt
+    if start + 2 * width < len(message):
+        excerpt += '…'
+    return render_snippet(excerpt)
+
+def search_messages(connection, user_id, query, limit, offset):
+    """Best matches first (bm25), with a highlighted snippet and the conversation title"""
+    match = match_query(query)
+    if match is None:
+        return []
+    
+    rows = connection.execute(text("""
+        SELECT f.message_id, f.conversation_id, f.is_bot, f.timestamp, f.snippet, s.title
+        FROM (
+            SELECT message_id, conversation_id, is_bot, timestamp, rank,
+                   snippet(messages_fts, 0, :mark_start, :mark_end, '…', 16) AS snippet
+            FROM messages_fts
+            WHERE messages_fts MATCH :match AND user_id = :user_id
+            ORDER BY rank
+            LIMIT :limit OFFSET :offset
+        ) f
+        LEFT JOIN conversation_summaries s ON s.user_id = :user_id AND s.id = f.conversation_id
+        ORDER BY f.rank
+    """), {
+        'match': f"{user_filter(user_id)} AND ({match})",
+        'user_id': user_id,
+        'mark_start': MARK_START,
+        'mark_end': MARK_END,
+        'limit': limit,
+        'offset': offset
+    }).fetchall()
+    
+    return [{
+        "message_id": row.message_id,
+        "conversation_id": row.conversation_id,
+        "title": row.title,
+        "is_bot": bool(int(row.is_bot)),
+        "timestamp": datetime.fromisoformat(row.timestamp).isoformat(),
+        "snippet": render_snippet(row.snippet)
+    } for row in rows]
@@ -0,0 +1,77 @@
+import atexit
+import queue
+import threading
+from database.db_handler import save_turns, save_turn
+
+class WriteBehindQueue:
+    """Bounded queue of chat turns saved by a background thread in batched transactions"""
+    
+    def __init__(self, max_size=1000, flush_interval=0.05, max_batch=50):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+    
+    def submit(self, turn):
+        """Queue a turn for saving. Returns False when the queue is full so the caller can write it itself."""
+        if self._stopped.is_set():
+            return False
+        try:
+            self._queue.put_nowait(turn)
+            return True
+        except queue.Full:
+            return False
+    
+    def pending(self):
+        return self._queue.qsize()
+    
+    def _next_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _write(self, batch):
+        if save_turns(batch):
+            return
+        # One bad turn shouldn't lose the whole batch, retry them one by one
+        for turn in batch:
+            if not save_turn(**turn):
+                print(f"Write-behind dropped a turn for conversation {turn['conversation_id']}")
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._next_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+    
+    def stop(self, timeout=10):
+        """Stop accepting turns and flush everything still queued"""
+        self._stopped.set()
+        self._thread.join(timeout)
+        while True:
+            batch = self._next_batch(0)
+            if not batch:
+                break
+            self._write(batch)
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+def get_write_behind(max_size, flush_interval, max_batch):
+    """Get the process-wide queue, starting its flusher thread on first use"""
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindQueue(max_size, flush_interval, max_batch)
+            # Flush on interpreter shutdown so queued turns aren't lost on a graceful restart
+            atexit.register(_write_behind.stop)
+        return _write_behind
@@ -0,0 +1,375 @@
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+class RateLimited(Exception):
+    """The request can't be admitted in time; answer 429 with Retry-After"""
+    
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def sqlite_connection(local, path):
+    """Per-thread connection to the shared admission database"""
+    # sqlite3 connections can't be shared between threads
+    connection = getattr(local, 'connection', None)
+    if connection is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode so the BEGIN IMMEDIATE below controls the transaction
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        local.connection = connection
+    return connection
+
+class MemoryBuckets:
+    """Per-user token buckets held in this process"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def take(self, key):
+        """Take a token. Returns 0 when admitted, otherwise the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            
+            # Buckets that have refilled are the same as no bucket, drop them now and then
+            if len(self._buckets) > 10000:
+                full_after = self.burst / self.rate
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < full_after}
+            return (1 - tokens) / self.rate
+
+class SQLiteBuckets:
+    """Token buckets in a local SQLite file, shared by all workers on a host"""
+    
+    def __init__(self, path, rate, burst):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self._local = threading.local()
+        self._writes = 0
+        
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS admission_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+    
+    def _connection(self):
+        return sqlite_connection(self._local, self.path)
+    
+    def take(self, key):
+        connection = self._connection()
+        now = time.time()
+        # The write lock makes read-modify-write atomic across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated_at FROM admission_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (self.burst, now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if wait == 0:
+                tokens -= 1
+            connection.execute("INSERT OR REPLACE INTO admission_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                               (key, tokens, now))
+            
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                connection.execute("DELETE FROM admission_buckets WHERE updated_at < ?", (now - self.burst / self.rate,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+class MemorySlots:
+    """Global concurrency cap for this process"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+    
+    def try_acquire(self):
+        """Returns a slot token, or None when all slots are taken"""
+        with self._lock:
+            if self.used >= self.limit:
+                return None
+            self.used += 1
+            return True
+    
+    def release(self, token):
+        with self._lock:
+            self.used -= 1
+    
+    def in_use(self):
+        return self.used
+
+class SQLiteSlots:
+    """Global concurrency cap shared by all workers on a host, as leases in a SQLite file"""
+    
+    def __init__(self, path, limit, lease_seconds):
+        self.path = path
+        self.limit = limit
+        # A worker that dies holding a slot gives it back once the lease runs out
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS admission_slots (
+                token TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            )
+        """)
+    
+    def _connection(self):
+        return sqlite_connection(self._local, self.path)
+    
+    def try_acquire(self):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM admission_slots WHERE expires_at < ?", (now,))
+            used = connection.execute("SELECT COUNT(*) FROM admission_slots").fetchone()[0]
+            token = None
+            if used < self.limit:
+                token = uuid.uuid4().hex
+                connection.execute("INSERT INTO admission_slots (token, expires_at) VALUES (?, ?)",
+                                   (token, now + self.lease_seconds))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return token
+    
+    def release(self, token):
+        connection = self._connection()
+        connection.execute("DELETE FROM admission_slots WHERE token = ?", (token,))
+    
+    def in_use(self):
+        connection = self._connection()
+        return connection.execute("SELECT COUNT(*) FROM admission_slots WHERE expires_at >= ?", (time.time(),)).fetchone()[0]
+
+class Ticket:
+    """A granted slot; release it when the model call is done. Releasing twice is harmless."""
+    
+    def __init__(self, controller, token):
+        self.controller = controller
+        self.token = token
+    
+    def release(self):
+        if self.token is not None:
+            token, self.token = self.token, None
+            self.controller.release(token)
+
+# Stands in for a ticket when admission control is off
+NO_TICKET = Ticket(None, None)
+
+class Waiter:
+    def __init__(self, user_id, notify):
+        self.user_id = user_id
+        self.notify = notify
+        self.token = None
+
+class AdmissionController:
+    """Token bucket per user, then a global concurrency cap with a bounded queue served round-robin across users.
+    
+    A user with many requests waiting only gets every Nth free slot, where N is the number of users waiting.
+    """
+    
+    def __init__(self, buckets, slots, max_queue, max_queue_per_user, max_wait, poll_interval=0.1):
+        self.buckets = buckets
+        self.slots = slots
+        # Taking tokens and slots from SQLite can wait on its write lock
+        self.blocking = isinstance(buckets, SQLiteBuckets) or isinstance(slots, SQLiteSlots)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        # Slots freed by other workers don't notify us, so waiters check back this often
+        self.poll_interval = poll_interval
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = {'rate': 0, 'queue_full': 0, 'timeout': 0}
+    
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        return RateLimited(reason, retry_after)
+    
+    def _enqueue(self, user_id, notify, rate_limited=True):
+        """Returns a Ticket when a slot is free right away, otherwise the queued Waiter"""
+        wait = self.buckets.take(user_id) if rate_limited else 0
+        with self._lock:
+            if wait > 0:
+                raise self._reject('rate', wait)
+            
+            # Nobody waiting, so taking a free slot doesn't jump the queue
+            if not self._queued:
+                token = self.slots.try_acquire()
+                if token is not None:
+                    self.admitted += 1
+                    return Ticket(self, token)
+            
+            user_queue = self._queues.get(user_id)
+            if self._queued >= self.max_queue or (user_queue and len(user_queue) >= self.max_queue_per_user):
+                raise self._reject('queue_full', self.max_wait)
+            
+            waiter = Waiter(user_id, notify)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._queued += 1
+            return waiter
+    
+    def _dispatch(self):
+        """Hand free slots to waiters, one user at a time. Call with the lock held."""
+        while self._queued:
+            token = self.slots.try_acquire()
+            if token is None:
+                return
+            user_id, user_queue = next(iter(self._queues.items()))
+            waiter = user_queue.popleft()
+            self._queued -= 1
+            if user_queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            waiter.token = token
+            self.admitted += 1
+            waiter.notify()
+    
+    def _cancel(self, waiter):
+        """Give up waiting. Returns a Ticket if the slot was granted in the meantime."""
+        with self._lock:
+            if waiter.token is not None:
+                return Ticket(self, waiter.token)
+            user_queue = self._queues.get(waiter.user_id)
+            if user_queue is not None and waiter in user_queue:
+                user_queue.remove(waiter)
+                self._queued -= 1
+                if not user_queue:
+                    del self._queues[waiter.user_id]
+            raise self._reject('timeout', self.max_wait)
+    
+    def _poll(self, waiter):
+        with self._lock:
+            self._dispatch()
+            return waiter.token is not None
+    
+    def release(self, token):
+        with self._lock:
+            self.slots.release(token)
+            self._dispatch()
+    
+    def acquire(self, user_id, rate_limited=True):
+        """Block until a slot is free. Raises RateLimited when the user is over their rate or it takes longer than max_wait.
+        
+        `rate_limited=False` skips the token bucket but still queues fairly for a slot, for
+        work whose pace is already bounded elsewhere, like batch job workers.
+        """
+        event = threading.Event()
+        result = self._enqueue(user_id, event.set, rate_limited)
+        if isinstance(result, Ticket):
+            return result
+        
+        deadline = time.monotonic() + self.max_wait
+        while not event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or event.wait(min(self.poll_interval, remaining)) or self._poll(result):
+                break
+        if result.token is None:
+            return self._cancel(result)
+        return Ticket(self, result.token)
+    
+    async def acquire_async(self, user_id, executor=None):
+        """Same as acquire, waiting on the event loop instead of a thread.
+        
+        With the sqlite backend, calls that touch the database run on `executor` so a busy
+        database lock doesn't stall the loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        offload = executor is not None and self.blocking
+        
+        async def call(func, *args):
+            if not offload:
+                return func(*args)
+            return await loop.run_in_executor(executor, functools.partial(func, *args))
+        
+        def notify():
+            # Slots can be freed by another thread, e.g. a sync request or the database executor
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+        
+        def give_up():
+            # Free any slot a cancelled waiter was given in the meantime
+            try:
+                self._cancel(result).release()
+            except RateLimited:
+                pass
+        
+        result = await call(self._enqueue, user_id, notify)
+        if isinstance(result, Ticket):
+            return result
+        
+        deadline = loop.time() + self.max_wait
+        while not future.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(future), min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                if await call(self._poll, result):
+                    break
+            except asyncio.CancelledError:
+                # The client went away while queued; don't wait for the cleanup
+                if offload:
+                    loop.run_in_executor(executor, give_up)
+                else:
+                    give_up()
+                raise
+        if result.token is None:
+            return await call(self._cancel, result)
+        return Ticket(self, result.token)
+    
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queued, 'in_use': self.slots.in_use(), 'admitted': self.admitted,
+                    'rejected': dict(self.rejected)}
+
+def build_admission(config):
+    """Create the controller for ADMISSION_BACKEND, or None when admission control is off"""
+    if not config.ADMISSION_ENABLED:
+        return None
+    
+    backend = config.ADMISSION_BACKEND
+    if backend == 'memory':
+        buckets = MemoryBuckets(config.ADMISSION_RATE, config.ADMISSION_BURST)
+        slots = MemorySlots(config.ADMISSION_MAX_CONCURRENT)
+    elif backend == 'sqlite':
+        buckets = SQLiteBuckets(config.ADMISSION_PATH, config.ADMISSION_RATE, config.ADMISSION_BURST)
+        slots = SQLiteSlots(config.ADMISSION_PATH, config.ADMISSION_MAX_CONCURRENT, config.ADMISSION_SLOT_LEASE)
+    else:
+        raise ValueError(f"Unknown ADMISSION_BACKEND: {backend}")
+    
+    return AdmissionController(buckets, slots, config.ADMISSION_MAX_QUEUE, config.ADMISSION_MAX_QUEUE_PER_USER,
+                               config.ADMISSION_MAX_WAIT)
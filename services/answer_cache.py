@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+def normalize_message(message):
+    """Fold case, width and whitespace so trivially different phrasings share a cache entry"""
+    text = unicodedata.normalize('NFKC', message or '').casefold()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(' ?!.')
+
+def make_key(message, language, prompt_version, image_hash=None, model=''):
+    """Cache key for a first-turn question"""
+    parts = [normalize_message(message), language, str(prompt_version), image_hash or '', model]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+class MemoryCache:
+    """In-process LRU with a per-entry TTL"""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteCache:
+    """Local SQLite file cache with TTL and least-recently-used eviction, shared by all workers on a host"""
+    
+    # Hits are recorded in memory and written in one transaction this often, so reads
+    # don't take the database's write lock
+    ACCESS_FLUSH_SECONDS = 30
+    
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+        self._last_access_flush = time.time()
+        
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_answer_cache_last_access ON answer_cache (last_access)")
+        connection.commit()
+    
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    def get(self, key):
+        return self.get_with_ttl(key)[0]
+    
+    def get_with_ttl(self, key):
+        """Returns (value, seconds until it expires), or (None, None) on a miss"""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute("SELECT value, expires_at FROM answer_cache WHERE key = ?", (key,)).fetchone()
+        # Expired rows are left for the periodic trim in set()
+        if row is None or row[1] < now:
+            return None, None
+        self._record_access(connection, key, now)
+        return row[0], row[1] - now
+    
+    def _record_access(self, connection, key, now):
+        with self._accessed_lock:
+            self._accessed[key] = now
+            if now - self._last_access_flush < self.ACCESS_FLUSH_SECONDS:
+                return
+            accessed, self._accessed = self._accessed, {}
+            self._last_access_flush = now
+        connection.executemany("UPDATE answer_cache SET last_access = ? WHERE key = ?",
+                               [(accessed_at, accessed_key) for accessed_key, accessed_at in accessed.items()])
+        connection.commit()
+    
+    def set(self, key, value, ttl=None):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO answer_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, now + (ttl or self.ttl), now)
+        )
+        
+        # Counting rows on every write is wasteful, trim the table every so often
+        self._writes += 1
+        if self._writes % 100 == 0:
+            connection.execute("DELETE FROM answer_cache WHERE expires_at < ?", (now,))
+            connection.execute("""
+                DELETE FROM answer_cache WHERE key IN (
+                    SELECT key FROM answer_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+        connection.commit()
+
+class TieredCache:
+    """Memory cache in front of a slower shared tier; hits in the slow tier are promoted"""
+    
+    def __init__(self, front, back):
+        self.front = front
+        self.back = back
+    
+    def get(self, key):
+        value = self.front.get(key)
+        if value is None:
+            value, remaining = self.back.get_with_ttl(key)
+            if value is not None:
+                # Keep the original expiry, a promotion doesn't restart the TTL
+                self.front.set(key, value, remaining)
+        return value
+    
+    def set(self, key, value, ttl=None):
+        self.front.set(key, value, ttl)
+        self.back.set(key, value, ttl)
+
+def build_answer_cache(config):
+    """Create the backend named by ANSWER_CACHE_BACKEND, or None when caching is off"""
+    backend = config.ANSWER_CACHE_BACKEND
+    if backend == 'none':
+        return None
+    
+    memory = MemoryCache(config.ANSWER_CACHE_MAX_ENTRIES, config.ANSWER_CACHE_TTL)
+    if backend == 'memory':
+        return memory
+    
+    disk = SQLiteCache(config.ANSWER_CACHE_PATH, config.ANSWER_CACHE_DISK_MAX_ENTRIES, config.ANSWER_CACHE_TTL)
+    if backend == 'sqlite':
+        return disk
+    if backend == 'tiered':
+        return TieredCache(memory, disk)
+    
+    raise ValueError(f"Unknown ANSWER_CACHE_BACKEND: {backend}")
@@ -0,0 +1,457 @@
+"""The chat pipeline behind /api/chat and /api/chat/stream, shared by the Flask routes in
+app.py and the async front end in asgi.py: prompt building, the answer cache, admission
+control, the text-only image fallback and saving turns. The front ends only do the I/O.
+"""
+import base64
+import math
+import threading
+import uuid
+from datetime import datetime
+from config import Config
+from database.db_handler import get_recent_messages, get_messages_between, get_context_summary, save_context_summary, save_turns, store_image, get_image_by_id
+from database.write_behind import get_write_behind
+from database.image_store import image_store
+from services.image_processing import preprocess_image
+from services.rendering import render_markdown, render_cached, SANITIZER_VERSION
+from services.metrics import stage
+from services.answer_cache import build_answer_cache, make_key
+from services.context_builder import fit_history, message_tokens, summary_message, summary_prompt, summary_updater
+from services.llm_client import LLMClient, classify_error, CircuitOpenError
+from services.admission import build_admission
+
+# Groq client, answer cache and admission control are created on first use, so workers
+# start without importing the Groq SDK or opening cache and admission databases
+_client = None
+_client_failed = False
+_client_lock = threading.Lock()
+
+_answer_cache = None
+_answer_cache_built = False
+_answer_cache_lock = threading.Lock()
+
+def get_client():
+    """The Groq client, or None when it failed to initialize"""
+    global _client, _client_failed
+    if _client is None and not _client_failed:
+        with _client_lock:
+            if _client is None and not _client_failed:
+                try:
+                    # Pooled connections, retries, circuit breaking and coalescing of identical requests
+                    _client = LLMClient(Config)
+                except Exception as e:
+                    print(f"Failed to initialize Groq client: {str(e)}")
+                    _client_failed = True
+    return _client
+
+def get_answer_cache():
+    """Answers to repeated first-turn questions, None when disabled"""
+    global _answer_cache, _answer_cache_built
+    if not _answer_cache_built:
+        with _answer_cache_lock:
+            if not _answer_cache_built:
+                _answer_cache = build_answer_cache(Config)
+                _answer_cache_built = True
+    return _answer_cache
+
+_admission = None
+_admission_built = False
+_admission_lock = threading.Lock()
+
+def get_admission():
+    """Per-user rate limits and fair queuing in front of the model, None when disabled"""
+    global _admission, _admission_built
+    if not _admission_built:
+        with _admission_lock:
+            if not _admission_built:
+                # The sqlite backend opens its database and creates tables here
+                _admission = build_admission(Config)
+                _admission_built = True
+    return _admission
+
+MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+# Bump whenever build_system_message changes so cached answers aren't reused
+SYSTEM_PROMPT_VERSION = 1
+
+IMAGE_FALLBACK_PROMPT = "I've uploaded an image of olive trees/fruits. Please analyze it for any visible issues or diseases."
+IMAGE_FALLBACK_NOTE = "**Note: I couldn't process the image, but I can still help with your text query.**\n\n"
+RATE_LIMIT_MESSAGE = "Too many requests, please wait a moment and try again."
+CHAT_ERROR_MESSAGE = "There was an error processing your request. If you uploaded an image, please try again with text only as this model may not support image processing through the Groq API."
+
+def detect_language(message):
+    """Guess the user's language from a few common words"""
+    user_language = "en"  # Default to English
+    if message and len(message.strip()) > 0:
+        # Simple language detection based on common words
+        message_lower = message.lower()
+        if any(word in message_lower for word in ['bonjour', 'salut', 'merci', 'comment']):
+            user_language = "fr"
+        elif any(word in message_lower for word in ['hola', 'gracias', 'como', 'qué']):
+            user_language = "es"
+        elif any(word in message_lower for word in ['مرحبا', 'شكرا', 'كيف', 'سلام']):
+            user_language = "ar"
+    return user_language
+
+def build_system_message(user_language):
+    """Prepare the system message for olive expertise with language and conciseness instruction"""
+    return f"""
+    You are an expert in agriculture, specifically olives and olive diseases. 
+    Provide accurate and helpful information about olive cultivation, diseases, treatments, 
+    and best practices. Your answers should be informative and understandable to farmers 
+    and enthusiasts. If an image is provided, analyze it for signs of diseases or issues 
+    with olive trees or fruits.
+    
+    IMPORTANT INSTRUCTIONS:
+    1. Format your responses using markdown for better readability.
+    2. Be concise and to the point. Limit your response to 3-4 sentences when possible.
+    3. Respond in the same language as the user's query. The detected language is: {user_language}.
+    4. For diseases, quickly identify the disease name, key symptoms, and basic treatment.
+    5. Refer to the chat history to maintain context in the conversation.
+    6. Address the user as Zouhaier in your responses.
+    7. If the user mentions something from earlier in the conversation, acknowledge it.
+    """
+
+def is_image_error(error):
+    """Check whether a Groq error is the model rejecting image content"""
+    return classify_error(error) == 'image_unsupported'
+
+def chat_error_response(error):
+    """Status, body and headers for a failed model call; an open circuit breaker is a 503 with Retry-After"""
+    body = {'error': str(error), 'message': CHAT_ERROR_MESSAGE}
+    if isinstance(error, CircuitOpenError):
+        return 503, body, {'Retry-After': str(int(error.retry_after + 0.5))}
+    return 500, body, {}
+
+def load_request_image(data, user_id, conversation_id):
+    """Get the base64 payload for the chat request's image, saving data URL uploads to the image store"""
+    image_data = data.get('image')
+    image_id = data.get('image_id')
+    pending_image = None
+    image_base64 = None
+    image_sha256 = None
+    mime_type = "image/jpeg"
+    if image_id:
+        # Image uploaded beforehand through /api/uploads, base64 is only needed for the Groq payload
+        try:
+            image = get_image_by_id(image_id)
+            if image and image['user_id'] == user_id:
+                mime_type = image['mime_type']
+                image_sha256 = image['sha256']
+                image_base64 = base64.b64encode(image_store.read_bytes(image['sha256'])).decode('ascii')
+            else:
+                image_id = None
+        except Exception as e:
+            print(f"Error loading uploaded image: {str(e)}")
+            image_id = None
+    elif image_data:
+        # Legacy clients send the image as a data URL inside the JSON body
+        # Extract base64 data and the MIME type from the data URL header
+        if "base64," in image_data:
+            header, image_base64 = image_data.split("base64,", 1)
+            if header.startswith("data:image/"):
+                mime_type = header[len("data:"):].rstrip(";")
+        else:
+            image_base64 = image_data
+        
+        # Shrink the image before storing it and sending it to the model
+        try:
+            image_bytes, mime_type, thumb_bytes = preprocess_image(base64.b64decode(image_base64))
+            image_base64 = base64.b64encode(image_bytes).decode('ascii')
+            # Only the file is written now, its row is saved with the rest of the turn
+            pending_image = store_image(image_bytes, mime_type, thumb_bytes)
+            image_sha256 = pending_image['sha256']
+        except Exception as e:
+            print(f"Error saving image: {str(e)}")
+    
+    return {
+        'image_id': image_id,
+        'pending_image': pending_image,
+        'base64': image_base64,
+        'sha256': image_sha256,
+        'mime_type': mime_type
+    }
+
+def user_content(message, image_base64=None, mime_type="image/jpeg"):
+    """Content of the user's message: plain text, or a multimodal array when there is an image"""
+    if not image_base64:
+        return message
+    
+    # Prepare content array for multimodal input
+    content_array = []
+    
+    # Add text part if present
+    if message:
+        content_array.append({
+            "type": "text",
+            "text": message
+        })
+    
+    # Add image to content array
+    content_array.append({
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:{mime_type};base64,{image_base64}"
+        }
+    })
+    return content_array
+
+def prepare_chat(data, user_id):
+    """Build the Groq message list for a chat request and save any uploaded image"""
+    message = data.get('message', '')
+    conversation_id = data.get('conversation_id') or str(uuid.uuid4())
+    
+    # Detect language from user message for concise response
+    user_language = detect_language(message)
+    
+    # Format messages for the API
+    system_message = build_system_message(user_language)
+    messages = [{"role": "system", "content": system_message}]
+    
+    # Get conversation history if available, newest first until the token budget is used up
+    history_count = 0
+    summary_boundary = None
+    try:
+        with stage('history'):
+            recent = get_recent_messages(user_id, conversation_id, Config.CONTEXT_MAX_MESSAGES)
+            history_count = len(recent)
+            
+            summary, summarized_until = None, None
+            if recent and Config.CONTEXT_SUMMARY_ENABLED:
+                summary, summarized_until = get_context_summary(user_id, conversation_id)
+        
+        with stage('prompt'):
+            budget = Config.CONTEXT_TOKEN_BUDGET - message_tokens(system_message) - message_tokens(message)
+            if summary:
+                messages.append(summary_message(summary))
+                budget -= message_tokens(messages[-1]['content'])
+            
+            kept, dropped = fit_history(recent, budget)
+            for is_bot, content, _ in kept:
+                role = "assistant" if is_bot else "user"
+                messages.append({"role": role, "content": content})
+        
+        # Messages older than the window that the summary doesn't cover yet
+        if Config.CONTEXT_SUMMARY_ENABLED and recent:
+            oldest_unsummarized = dropped[-1] if dropped else recent[0]
+            may_have_older = dropped or len(recent) == Config.CONTEXT_MAX_MESSAGES
+            if may_have_older and (summarized_until is None or oldest_unsummarized[2] > summarized_until):
+                summary_boundary = kept[0][2] if kept else datetime.now()
+    except Exception as e:
+        print(f"Error retrieving conversation history: {str(e)}")
+        # Continue without history if there's an error
+    
+    with stage('image'):
+        image = load_request_image(data, user_id, conversation_id)
+    image_base64 = image['base64']
+    mime_type = image['mime_type']
+    
+    # Prepare the user message with text and optional image
+    messages.append({"role": "user", "content": user_content(message, image_base64, mime_type)})
+    
+    chat_request = {
+        'message': message,
+        'language': user_language,
+        'history_count': history_count,
+        'summary_boundary': summary_boundary,
+        'image_sha256': image['sha256'],
+        'has_image': bool(image_base64),
+        'image_id': image['image_id'],
+        'pending_image': image['pending_image'],
+        'conversation_id': conversation_id,
+        'messages': messages
+    }
+    chat_request['cache_key'] = answer_cache_key(chat_request)
+    return chat_request
+
+def answer_cache_key(chat_request):
+    """Cache key for first-turn requests, None when the answer depends on earlier turns"""
+    if get_answer_cache() is None or chat_request['history_count'] > 0:
+        return None
+    # An image we couldn't hash would make different photos share an answer
+    if chat_request['has_image'] and not chat_request['image_sha256']:
+        return None
+    return make_key(chat_request['message'], chat_request['language'], SYSTEM_PROMPT_VERSION,
+                    chat_request['image_sha256'], MODEL_NAME)
+
+def get_cached_answer(chat_request):
+    """Look up a previous answer to the same first-turn question"""
+    if not chat_request['cache_key']:
+        return None
+    try:
+        answer = get_answer_cache().get(chat_request['cache_key'])
+        if answer is not None:
+            print("Answer cache hit, skipping the Groq API")
+        return answer
+    except Exception as e:
+        print(f"Error reading answer cache: {str(e)}")
+        return None
+
+def cache_answer(chat_request, bot_response):
+    if not chat_request['cache_key']:
+        return
+    try:
+        get_answer_cache().set(chat_request['cache_key'], bot_response)
+    except Exception as e:
+        print(f"Error writing answer cache: {str(e)}")
+
+def text_only_messages(chat_request):
+    """Replace the multimodal user message with a text-only one for the fallback request"""
+    messages = list(chat_request['messages'])
+    messages[-1] = {
+        "role": "user", 
+        "content": chat_request['message'] if chat_request['message'] else IMAGE_FALLBACK_PROMPT
+    }
+    return messages
+
+def model_messages(chat_request):
+    """Messages to send, going straight to text only when the model is known to reject images. Returns (messages, fallback)."""
+    if chat_request['has_image'] and not get_client().supports(MODEL_NAME, 'image'):
+        print("Model doesn't support images, sending a text-only request")
+        return text_only_messages(chat_request), True
+    return chat_request['messages'], False
+
+def completion_params(messages, stream=False):
+    """Arguments for a Groq chat completions call, shared by the sync and async clients"""
+    print(f"Sending request to Groq API with model: {MODEL_NAME}")
+    print(f"Number of messages in context: {len(messages)}")
+    
+    return {
+        'model': MODEL_NAME,
+        'messages': messages,
+        'temperature': 0.5,
+        'max_tokens': 1024,
+        'stream': stream
+    }
+
+def create_completion(messages, stream=False):
+    """Call the Groq chat completions API"""
+    return get_client().create(**completion_params(messages, stream))
+
+def persist_turn(user_id, chat_request, bot_response, html_response):
+    """Save the user's message, image reference and the bot's markdown response, continuing even if it fails"""
+    user_msg = chat_request['message'] if chat_request['message'] else "[Image uploaded]"
+    turn = {
+        'user_id': user_id,
+        'conversation_id': chat_request['conversation_id'],
+        'user_message': user_msg,
+        'bot_message': bot_response,  # Save the markdown version along with the sanitized HTML
+        'timestamp': datetime.now(),
+        'image_id': chat_request['image_id'],
+        'image': chat_request['pending_image'],
+        'html': html_response,
+        'html_version': SANITIZER_VERSION
+    }
+    
+    # Hand the turn to the background writer so the response doesn't wait on the commit
+    queued = False
+    if Config.WRITE_BEHIND_ENABLED:
+        write_behind = get_write_behind(Config.WRITE_BEHIND_MAX_QUEUE,
+                                        Config.WRITE_BEHIND_FLUSH_INTERVAL,
+                                        Config.WRITE_BEHIND_MAX_BATCH)
+        queued = write_behind.submit(turn)
+    
+    # Single transaction for the whole turn; a full queue falls through to here
+    if not queued:
+        with stage('db_write'):
+            saved = save_turns([turn])
+        if not saved:
+            print("Warning: Failed to save conversation to database")
+    
+    # Fold messages that fell out of the context window into the rolling summary
+    if chat_request['summary_boundary'] is not None and get_client() is not None:
+        summary_updater.schedule(
+            (user_id, chat_request['conversation_id']),
+            lambda: update_context_summary(user_id, chat_request['conversation_id'], chat_request['summary_boundary'])
+        )
+
+def update_context_summary(user_id, conversation_id, boundary):
+    """Incrementally summarize unsummarized messages older than `boundary`, a batch per model call"""
+    batch_size = Config.CONTEXT_SUMMARY_BATCH
+    while True:
+        summary, summarized_until = get_context_summary(user_id, conversation_id)
+        new_messages = get_messages_between(user_id, conversation_id, summarized_until, boundary, batch_size)
+        if not new_messages:
+            return
+        
+        # A full batch may have cut a turn in half, leave its last timestamp for the next round
+        if len(new_messages) == batch_size:
+            last_timestamp = new_messages[-1][2]
+            trimmed = [msg for msg in new_messages if msg[2] != last_timestamp]
+            new_messages = trimmed or new_messages
+        
+        prompt = summary_prompt(summary, new_messages, Config.CONTEXT_SUMMARY_MAX_TOKENS * 3 // 4)
+        response = get_client().create(
+            model=MODEL_NAME,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=Config.CONTEXT_SUMMARY_MAX_TOKENS
+        )
+        new_summary = response.choices[0].message.content.strip()
+        if not save_context_summary(user_id, conversation_id, new_summary, new_messages[-1][2]):
+            return
+
+def rate_limit_error(error):
+    """Status, body and headers for a chat turned away by admission control"""
+    print(f"Chat request rejected by admission control: {error.reason}")
+    body = {'error': str(error), 'message': RATE_LIMIT_MESSAGE}
+    return 429, body, {'Retry-After': str(math.ceil(error.retry_after))}
+
+def can_fall_back(chat_request, fallback, error):
+    """Whether a failed model call should be retried without the image"""
+    return not fallback and chat_request['has_image'] and is_image_error(error)
+
+def answer_text(response, fallback):
+    """The answer in a completed (non-streamed) response, noting when the image was dropped"""
+    text = response.choices[0].message.content
+    return IMAGE_FALLBACK_NOTE + text if fallback else text
+
+def chunk_text(chunk):
+    """The text a streamed completion chunk adds, None when it has none"""
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+def error_event(error):
+    """Payload of the SSE `error` event for a failed model call"""
+    status, body, headers = chat_error_response(error)
+    return dict(body, status=status, retry_after=headers.get('Retry-After'))
+
+def answer_body(chat_request, bot_response, html_response):
+    return {
+        'response': html_response,  # Send the HTML version to the frontend
+        'raw_response': bot_response,  # Also send the raw markdown for history
+        'conversation_id': chat_request['conversation_id']
+    }
+
+def finish_cached(user_id, chat_request, bot_response):
+    """Render and save a turn answered from the cache. Returns the response body."""
+    with stage('render'):
+        html_response = render_cached(bot_response)
+    persist_turn(user_id, chat_request, bot_response, html_response)
+    return answer_body(chat_request, bot_response, html_response)
+
+def finish_answer(user_id, chat_request, bot_response, fallback):
+    """Render, cache and save the model's answer. Returns the response body."""
+    with stage('render'):
+        html_response = render_markdown(bot_response)
+    # Text-only fallback answers didn't look at the image, so they aren't reused for it
+    if not fallback:
+        cache_answer(chat_request, bot_response)
+    # Persist only once the full answer is known
+    persist_turn(user_id, chat_request, bot_response, html_response)
+    return answer_body(chat_request, bot_response, html_response)
+
+def chat_metrics():
+    """/metrics samples of the Groq client and admission control, when they've been created"""
+    samples = []
+    # Don't create the client just to report that it's idle
+    if _client is not None:
+        samples.extend(_client.metrics())
+    if _admission is not None:
+        admission_stats = _admission.stats()
+        samples.append(('olive_admission_queued', 'gauge', 'Chat requests waiting for a model slot', admission_stats['queued']))
+        samples.append(('olive_admission_in_use', 'gauge', 'Model slots in use', admission_stats['in_use']))
+        samples.append(('olive_admission_admitted_total', 'counter', 'Chat requests given a model slot', admission_stats['admitted']))
+        for reason, count in admission_stats['rejected'].items():
+            samples.append((f'olive_admission_rejected_{reason}_total', 'counter', f'Chat requests rejected with 429 ({reason})', count))
+    return samples
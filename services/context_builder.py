@@ -0,0 +1,133 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# tiktoken is optional; its counts are close enough for budgeting even on non-OpenAI models.
+# A cold cache downloads the encoding with no timeout, so it's loaded in a background thread
+# started by the first count, and counts are estimated until it's ready.
+_encoding = None
+_encoding_thread = None
+_encoding_ready = threading.Event()
+_encoding_lock = threading.Lock()
+# How long the count that starts the load waits for it, enough for an encoding already on disk
+ENCODING_WAIT_SECONDS = 0.5
+
+# Role markers and separators the chat template adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _load_encoding():
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding('cl100k_base')
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Error loading tiktoken encoding, estimating token counts instead: {str(e)}")
+    finally:
+        _encoding_ready.set()
+
+def get_encoding():
+    """The tiktoken encoding, or None while it's loading, when tiktoken is missing or the load failed"""
+    global _encoding_thread
+    if _encoding_ready.is_set():
+        return _encoding
+    with _encoding_lock:
+        started = _encoding_thread is None
+        if started:
+            _encoding_thread = threading.Thread(target=_load_encoding, name='tiktoken-load', daemon=True)
+            _encoding_thread.start()
+    if started:
+        _encoding_ready.wait(ENCODING_WAIT_SECONDS)
+    return _encoding
+
+def count_tokens(text):
+    """Count (or estimate, at roughly 4 characters per token) the tokens in a string"""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+def message_tokens(text):
+    return count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+def fit_history(recent, budget):
+    """Pick the newest messages that fit in `budget` tokens.
+    
+    `recent` is a list of (is_bot, message, timestamp) tuples, oldest first. Returns
+    (kept, dropped), both oldest first. A user message and the reply saved with it share a
+    timestamp, so a turn that doesn't fit completely is dropped as a whole.
+    """
+    used = 0
+    start = len(recent)
+    for index in range(len(recent) - 1, -1, -1):
+        cost = message_tokens(recent[index][1])
+        if used + cost > budget:
+            break
+        used += cost
+        start = index
+    
+    # Don't keep half of a turn
+    while 0 < start < len(recent) and recent[start][2] == recent[start - 1][2]:
+        start += 1
+    
+    return recent[start:], recent[:start]
+
+def summary_message(summary):
+    """System message carrying the rolling summary of turns that no longer fit"""
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier part of this conversation:\n{summary}"
+    }
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a farmer and an olive expert.
+Update the summary with the new messages below. Keep orchard details, symptoms, diagnosed
+diseases, treatments and anything the farmer may refer back to. Drop greetings and repetition.
+Reply with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+def summary_prompt(previous_summary, messages, max_words):
+    """Prompt that folds `messages` (is_bot, message, timestamp) into the previous summary"""
+    lines = []
+    for is_bot, message, _ in messages:
+        lines.append(f"{'Expert' if is_bot else 'Farmer'}: {message}")
+    return SUMMARY_PROMPT.format(
+        max_words=max_words,
+        summary=previous_summary or "(empty)",
+        messages="\n".join(lines)
+    )
+
+class SummaryUpdater:
+    """Folds messages that fell out of the context window into a stored summary, off the request path"""
+    
+    def __init__(self, workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='context-summary')
+        self._running = set()
+        self._lock = threading.Lock()
+    
+    def schedule(self, key, job):
+        """Run `job` in the background unless one is already running for this conversation"""
+        with self._lock:
+            if key in self._running:
+                return
+            self._running.add(key)
+        
+        def run():
+            try:
+                job()
+            except Exception as e:
+                print(f"Error updating context summary: {str(e)}")
+            finally:
+                with self._lock:
+                    self._running.discard(key)
+        
+        self._executor.submit(run)
+
+summary_updater = SummaryUpdater()
@@ -0,0 +1,150 @@
+import importlib.util
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+# Pillow is optional: without it uploads are stored as sent, only the MIME type is sniffed.
+# It's imported on first use, normally inside a worker process, so app startup doesn't load it.
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+_pillow = None
+
+def load_pillow():
+    """Import Pillow and the HEIC plugin once per process. Returns (Image, ImageOps)."""
+    global _pillow
+    if _pillow is None:
+        from PIL import Image as PILImage, ImageOps
+        # HEIC photos from iPhones need the pillow-heif plugin
+        try:
+            import pillow_heif
+            pillow_heif.register_heif_opener()
+        except ImportError:
+            pass
+        _pillow = (PILImage, ImageOps)
+    return _pillow
+
+class ImageProcessingError(Exception):
+    """Raised when an upload can't be decoded as an image"""
+
+def detect_mime_type(data):
+    """Sniff the real image type from its magic bytes instead of trusting the client"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp' and data[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic'
+    return None
+
+def _encode_jpeg(image, quality):
+    output = io.BytesIO()
+    # No exif= argument, so EXIF (GPS position, device) is dropped from the output
+    image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+def _open_rgb(data):
+    """Decode an image upright and flattened to RGB. Returns (image, PIL.Image)."""
+    PILImage, ImageOps = load_pillow()
+    try:
+        image = PILImage.open(io.BytesIO(data))
+        # Apply the EXIF orientation before the EXIF data is thrown away
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise ImageProcessingError(f"Could not decode image: {str(e)}")
+    
+    # JPEG has no alpha channel, flatten transparent images onto white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image, PILImage
+
+def process_image(data, max_edge, quality, thumb_edge):
+    """Downscale, re-encode as EXIF-free JPEG and thumbnail an image.
+    
+    Runs in a worker process. Returns (image_bytes, mime_type, thumb_bytes), where
+    thumb_bytes is None when Pillow isn't installed.
+    """
+    mime_type = detect_mime_type(data)
+    if not HAS_PILLOW:
+        if mime_type is None:
+            raise ImageProcessingError("Unrecognized image format")
+        return data, mime_type, None
+    
+    image, PILImage = _open_rgb(data)
+    image.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+    image_bytes = _encode_jpeg(image, quality)
+    
+    thumb = image.copy()
+    thumb.thumbnail((thumb_edge, thumb_edge), PILImage.LANCZOS)
+    thumb_bytes = _encode_jpeg(thumb, quality)
+    
+    return image_bytes, 'image/jpeg', thumb_bytes
+
+def process_thumbnail(data, max_edge, quality, thumb_edge):
+    """Only the JPEG thumbnail, for images stored before uploads were preprocessed.
+    
+    Runs in a worker process. Returns None when Pillow isn't installed.
+    """
+    if not HAS_PILLOW:
+        return None
+    image, PILImage = _open_rgb(data)
+    image.thumbnail((thumb_edge, thumb_edge), PILImage.LANCZOS)
+    return _encode_jpeg(image, quality)
+
+def process_image_file(path, max_edge, quality, thumb_edge):
+    """Same as process_image but reads the upload from disk inside the worker"""
+    with open(path, 'rb') as image_file:
+        data = image_file.read()
+    return process_image(data, max_edge, quality, thumb_edge)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Create the worker pool on first use so importing this module stays cheap"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: a fork would copy the web worker's threads,
+            # locks and open database connections into the child
+            _pool = ProcessPoolExecutor(max_workers=Config.IMAGE_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _run(func, source):
+    args = (source, Config.IMAGE_MAX_EDGE, Config.IMAGE_JPEG_QUALITY, Config.IMAGE_THUMB_EDGE)
+    
+    # Decoding and resizing is CPU bound, keep it off the request thread's GIL
+    if Config.IMAGE_WORKERS > 0 and HAS_PILLOW:
+        global _pool
+        try:
+            return _get_pool().submit(func, *args).result(timeout=Config.IMAGE_PROCESS_TIMEOUT)
+        except BrokenProcessPool:
+            print("Image worker pool broke, restarting it")
+            with _pool_lock:
+                _pool = None
+            return _get_pool().submit(func, *args).result(timeout=Config.IMAGE_PROCESS_TIMEOUT)
+    return func(*args)
+
+def preprocess_image(data):
+    """Preprocess in-memory image bytes. Returns (image_bytes, mime_type, thumb_bytes)."""
+    return _run(process_image, data)
+
+def preprocess_image_file(path):
+    """Preprocess an image saved on disk. Returns (image_bytes, mime_type, thumb_bytes)."""
+    return _run(process_image_file, path)
+
+def make_thumbnail(data):
+    """Thumbnail in-memory image bytes, None without Pillow"""
+    return _run(process_thumbnail, data)
@@ -0,0 +1,51 @@
+import threading
+
+class JobWorkerPool:
+    """Threads that claim job items from the database queue and run them one at a time each"""
+    
+    def __init__(self, claim, process, workers, poll_interval):
+        self.claim = claim
+        self.process = process
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+                         for index in range(workers)]
+        for thread in self._threads:
+            thread.start()
+    
+    def notify(self):
+        """New items were queued, stop waiting for the next poll"""
+        self._wakeup.set()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            item = self.claim()
+            if item is None:
+                # Items queued by other processes or due for a retry are found by polling
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.process(item)
+            except Exception as e:
+                # process() records its own failures, this only keeps the thread alive
+                print(f"Error running job item {item['id']}: {str(e)}")
+    
+    def stop(self, timeout=10):
+        """Let running items finish; unfinished ones are picked up again after their lease runs out"""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_job_pool(claim, process, workers, poll_interval):
+    """Get the process-wide worker pool, starting its threads on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = JobWorkerPool(claim, process, workers, poll_interval)
+        return _pool
@@ -0,0 +1,339 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+class CircuitOpenError(Exception):
+    """Raised without calling Groq while the circuit breaker is open"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Groq API is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def error_message(error):
+    """The API's own error message when there is one, otherwise the exception text"""
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        inner = body.get('error', body)
+        if isinstance(inner, dict) and inner.get('message'):
+            return str(inner['message'])
+    return str(error)
+
+def classify_error(error):
+    """Sort a Groq SDK exception into 'image_unsupported', 'rate_limited', 'server', 'connection', 'circuit_open' or 'client'"""
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    # The SDK is imported by the first client, see LLMClient
+    import groq
+    if isinstance(error, groq.RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, groq.APIConnectionError):  # Includes APITimeoutError
+        return 'connection'
+    if isinstance(error, groq.APIStatusError):
+        if error.status_code >= 500:
+            return 'server'
+        # Only a rejected request can mean the model doesn't take images
+        if error.status_code in (400, 422):
+            message = error_message(error).lower()
+            if 'multimodal' in message or 'content array' in message or 'image' in message:
+                return 'image_unsupported'
+    return 'client'
+
+def retry_after_seconds(error):
+    """Delay requested by the Retry-After header, None when absent or unparseable"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('retry-after')
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+def has_image_content(messages):
+    return any(isinstance(msg.get('content'), list) and
+               any(part.get('type') == 'image_url' for part in msg['content'])
+               for msg in messages)
+
+def request_key(params):
+    """Identity of a non-streaming request, used to coalesce concurrent duplicates"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive upstream failures and lets one probe through after `reset_timeout` seconds"""
+    
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened_total = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+    
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self.probing = True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    self.opened_total += 1
+                self.opened_at = time.monotonic()
+                self.probing = False
+    
+    def release_probe(self):
+        """The probe ended in an error that says nothing about Groq's health"""
+        with self._lock:
+            self.probing = False
+
+class CapabilityMemory:
+    """Remembers features a model rejected, so requests skip straight to the fallback until `ttl` expires"""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._unsupported = {}
+        self._lock = threading.Lock()
+    
+    def supports(self, model, capability):
+        with self._lock:
+            marked_at = self._unsupported.get((model, capability))
+            if marked_at is None:
+                return True
+            if time.monotonic() - marked_at > self.ttl:
+                # Re-probe occasionally in case the model gained the feature
+                del self._unsupported[(model, capability)]
+                return True
+            return False
+    
+    def mark_unsupported(self, model, capability):
+        print(f"Model {model} doesn't support {capability}, skipping it for {self.ttl}s")
+        with self._lock:
+            self._unsupported[(model, capability)] = time.monotonic()
+
+class ClientStats:
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+    
+    def add(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+class LLMClientBase:
+    """Retry, circuit breaker, coalescing and capability state shared by the sync and async clients"""
+    
+    def __init__(self, config, breaker=None, capabilities=None, stats=None):
+        self.max_retries = config.GROQ_MAX_RETRIES
+        self.retry_base_delay = config.GROQ_RETRY_BASE_DELAY
+        self.retry_max_delay = config.GROQ_RETRY_MAX_DELAY
+        self.breaker = breaker or CircuitBreaker(config.GROQ_BREAKER_THRESHOLD, config.GROQ_BREAKER_RESET_SECONDS)
+        self.capabilities = capabilities or CapabilityMemory(config.GROQ_CAPABILITY_TTL)
+        self.stats = stats or ClientStats()
+    
+    def http_limits(self, config):
+        import httpx
+        return httpx.Limits(max_connections=config.GROQ_MAX_CONNECTIONS,
+                            max_keepalive_connections=config.GROQ_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=config.GROQ_KEEPALIVE_EXPIRY)
+    
+    def http_timeout(self, config):
+        import httpx
+        return httpx.Timeout(config.GROQ_TIMEOUT, connect=config.GROQ_CONNECT_TIMEOUT)
+    
+    def supports(self, model, capability):
+        return self.capabilities.supports(model, capability)
+    
+    def retry_delay(self, attempt, error):
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_max_delay))
+        return delay
+    
+    def handle_error(self, error, params, attempt):
+        """Update breaker and capability state. Returns the delay before retrying, or None to give up."""
+        kind = classify_error(error)
+        if kind in ('server', 'connection'):
+            self.breaker.record_failure()
+        else:
+            # Rate limits and rejected requests mean Groq is up and answering
+            self.breaker.release_probe()
+        if kind == 'image_unsupported' and has_image_content(params['messages']):
+            self.capabilities.mark_unsupported(params['model'], 'image')
+        
+        if kind in ('server', 'connection', 'rate_limited') and attempt < self.max_retries:
+            if self.breaker.state != 'closed':
+                return None
+            self.stats.add('retries')
+            delay = self.retry_delay(attempt, error)
+            print(f"Groq API {kind} error, retrying in {delay:.2f}s: {error_message(error)}")
+            return delay
+        self.stats.add('failures')
+        return None
+    
+    def metrics(self):
+        """Samples for the /metrics collector"""
+        state = self.breaker.state
+        return [
+            ('olive_groq_calls_total', 'counter', 'Upstream Groq API calls', self.stats.calls),
+            ('olive_groq_retries_total', 'counter', 'Groq API calls retried after a 429, 5xx or connection error', self.stats.retries),
+            ('olive_groq_failures_total', 'counter', 'Groq API requests that failed after retries', self.stats.failures),
+            ('olive_groq_coalesced_total', 'counter', 'Requests served by an identical in-flight request', self.stats.coalesced),
+            ('olive_groq_rejected_total', 'counter', 'Requests failed fast by the open circuit breaker', self.stats.rejected),
+            ('olive_groq_breaker_opened_total', 'counter', 'Times the circuit breaker opened', self.breaker.opened_total),
+            ('olive_groq_breaker_open', 'gauge', 'Whether the circuit breaker is open (0 closed, 1 open, 0.5 half open)',
+             {'closed': 0, 'open': 1, 'half_open': 0.5}[state]),
+        ]
+
+class LLMClient(LLMClientBase):
+    """Groq chat completions over a pooled keep-alive connection, with retries, a circuit breaker and coalescing"""
+    
+    def __init__(self, config, **shared):
+        super().__init__(config, **shared)
+        # Imported here so app workers that never call Groq don't pay for the SDK
+        import httpx
+        import groq
+        self.http_client = httpx.Client(limits=self.http_limits(config), timeout=self.http_timeout(config))
+        # Retries are ours, the SDK's own would hide failures from the breaker
+        self.client = groq.Groq(api_key=config.GROQ_API_KEY, base_url=config.GROQ_BASE_URL,
+                                http_client=self.http_client, max_retries=0)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+    
+    def create(self, **params):
+        """Same arguments as `chat.completions.create`; streams are retried only until the response starts"""
+        if params.get('stream'):
+            return self._call(params)
+        
+        key = request_key(params)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            self.stats.add('coalesced')
+            return future.result()
+        
+        try:
+            future.set_result(self._call(params))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+    
+    def _call(self, params):
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats.add('rejected')
+                raise
+            self.stats.add('calls')
+            try:
+                response = self.client.chat.completions.create(**params)
+            except Exception as e:
+                delay = self.handle_error(e, params, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return response
+    
+    def close(self):
+        self.http_client.close()
+
+class AsyncLLMClient(LLMClientBase):
+    """Async counterpart of LLMClient for the ASGI app, sharing its breaker and capability memory"""
+    
+    def __init__(self, config, **shared):
+        super().__init__(config, **shared)
+        import httpx
+        import groq
+        self.http_client = httpx.AsyncClient(limits=self.http_limits(config), timeout=self.http_timeout(config))
+        self.client = groq.AsyncGroq(api_key=config.GROQ_API_KEY, base_url=config.GROQ_BASE_URL,
+                                     http_client=self.http_client, max_retries=0)
+        # Only touched from the event loop, so no lock is needed
+        self._in_flight = {}
+    
+    async def create(self, **params):
+        if params.get('stream'):
+            return await self._call(params)
+        
+        key = request_key(params)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.add('coalesced')
+            # Shielded so a cancelled follower doesn't cancel the shared call
+            return await asyncio.shield(task)
+        
+        task = asyncio.ensure_future(self._call(params))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _call(self, params):
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats.add('rejected')
+                raise
+            self.stats.add('calls')
+            try:
+                response = await self.client.chat.completions.create(**params)
+            except Exception as e:
+                delay = self.handle_error(e, params, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled mid-call, don't leave a half-open breaker waiting on this probe forever
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return response
+    
+    async def close(self):
+        await self.http_client.aclose()
@@ -0,0 +1,140 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from fast DB reads up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels"""
+    
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    labels = _format_labels(self.label_names, label_values, ('le', bound))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, label_values, ('le', '+Inf'))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+class Registry:
+    """Holds histograms plus callbacks that report point-in-time values"""
+    
+    def __init__(self):
+        self._histograms = []
+        self._collectors = []
+    
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help_text, label_names, buckets)
+        self._histograms.append(histogram)
+        return histogram
+    
+    def register_collector(self, collector):
+        """`collector()` returns (name, type, help, value) tuples, type being 'gauge' or 'counter'"""
+        self._collectors.append(collector)
+    
+    def render(self):
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+                continue
+            for name, metric_type, help_text, value in samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'olive_stage_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage'))
+REQUEST_SECONDS = registry.histogram(
+    'olive_request_seconds', 'Time to produce the response headers', ('endpoint', 'status'))
+
+class Timings:
+    """Stage timings of one request, recorded into the histograms and echoed in Server-Timing"""
+    
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or 'unknown'
+        self.started = time.perf_counter()
+        self.stages = []
+    
+    def record(self, name, seconds):
+        self.stages.append((name, seconds))
+        STAGE_SECONDS.observe(seconds, self.endpoint, name)
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    def finish(self, status):
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, self.endpoint, str(status))
+    
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages)
+
+# Set per request (thread or asyncio task); stages outside a request aren't recorded anywhere
+_current = contextvars.ContextVar('timings', default=None)
+
+def start_request(endpoint):
+    timings = Timings(endpoint)
+    _current.set(timings)
+    return timings
+
+def current_timings():
+    return _current.get()
+
+@contextmanager
+def stage(name):
+    """Time a block as a stage of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
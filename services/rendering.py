@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+# Bump whenever the sanitizer policy below changes so stored HTML gets re-rendered
+SANITIZER_VERSION = 1
+
+# Tags and attributes kept when sanitizing rendered markdown
+ALLOWED_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em',
+                'ul', 'ol', 'li', 'blockquote', 'code', 'pre', 'br', 'a']
+ALLOWED_ATTRS = {'a': ['href', 'title']}
+
+def render_markdown(text):
+    """Convert markdown to HTML and sanitize it to prevent XSS"""
+    # Deferred: most requests serve HTML stored at write time and never render
+    import markdown
+    return sanitize_html(markdown.markdown(text))
+
+def sanitize_html(html):
+    """Strip everything outside the allowlist from HTML"""
+    import bleach
+    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS)
+
+class RenderCache:
+    """Thread-safe LRU of rendered HTML with a bounded number of entries"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+    
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._entries)
+
+render_cache = RenderCache(Config.RENDER_CACHE_SIZE)
+
+def render_cached(text, message_id=None, render=render_markdown):
+    """Render markdown (or sanitize HTML) through the LRU, keyed by message id or by content hash"""
+    key = (SANITIZER_VERSION, render.__name__, message_id or hashlib.sha256(text.encode('utf-8')).hexdigest())
+    html = render_cache.get(key)
+    if html is None:
+        html = render(text)
+        render_cache.put(key, html)
+    return html
+
+def message_html(msg):
+    """Get the HTML for a stored bot message, preferring the copy rendered at write time"""
+    if msg.get('html') and msg.get('html_version') == SANITIZER_VERSION:
+        return msg['html']
+    
+    # Very old rows were stored as HTML already, they still go through the allowlist
+    if msg.get('message', '').startswith('<'):
+        return render_cached(msg['message'], msg.get('id'), sanitize_html)
+    
+    return render_cached(msg.get('message', ''), msg.get('id'))
@@ -12,10 +12,19 @@ document.addEventListener('DOMContentLoaded', function() {
     const sidebar = document.getElementById('sidebar');
     const newChatButton = document.getElementById('new-chat');
     const historyContainer = document.getElementById('history-container');
+    const historySearch = document.getElementById('history-search');
+    const searchResults = document.getElementById('search-results');
     
     // State
     let currentConversationId = null;
     let currentImage = null;
+    let currentImageUrl = null;
+    let historyCursor = null;
+    let historyCache = null;
+    // Keyed per session so another visitor on this browser doesn't see these conversations
+    const HISTORY_CACHE_KEY = `olive-history:${historyContainer.dataset.historyKey || ''}`;
+    let searchController = null;
+    let searchTimer = null;
     
     // Auto resize textarea
     userInput.addEventListener('input', function() {
@@ -43,18 +52,12 @@ document.addEventListener('DOMContentLoaded', function() {
         chatContainer.appendChild(botMessage);
     });
     
-    // Handle image upload
+    // Handle image upload - keep the File itself, it is uploaded as binary on submit
     imageUpload.addEventListener('change', function(e) {
         if (e.target.files.length > 0) {
-            const file = e.target.files[0];
-            const reader = new FileReader();
-            
-            reader.onload = function(event) {
-                currentImage = event.target.result;
-                displayImagePreview(currentImage);
-            };
-            
-            reader.readAsDataURL(file);
+            currentImage = e.target.files[0];
+            currentImageUrl = URL.createObjectURL(currentImage);
+            displayImagePreview(currentImageUrl);
         }
     });
     
@@ -75,7 +78,7 @@ document.addEventListener('DOMContentLoaded', function() {
             imageElement.className = 'message user-message';
             imageElement.innerHTML = `
                 <div class="message-content">
-                    <img src="${currentImage}" alt="User uploaded image" style="max-width: 200px; max-height: 200px; border-radius: 8px;">
+                    <img src="${currentImageUrl}" alt="User uploaded image" style="max-width: 200px; max-height: 200px; border-radius: 8px;">
                 </div>
             `;
             chatContainer.appendChild(imageElement);
@@ -99,36 +102,80 @@ document.addEventListener('DOMContentLoaded', function() {
         userInput.style.height = 'auto';
         imagePreviewContainer.innerHTML = '';
         
-        // Send message to server
-        sendMessage(message, currentImage)
+        // Bot message that tokens are streamed into
+        const botMessage = document.createElement('div');
+        botMessage.className = 'message bot-message';
+        const botContent = document.createElement('div');
+        botContent.className = 'message-content';
+        botMessage.appendChild(botContent);
+        
+        let streamedText = '';
+        let renderPending = false;
+        let streamFinished = false;
+        
+        // Render the partial markdown at most once per frame
+        function scheduleRender() {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(function() {
+                renderPending = false;
+                if (streamFinished) return;
+                botContent.innerHTML = renderMarkdown(streamedText);
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+            });
+        }
+        
+        // Upload the image first, then send message to server
+        const imageFile = currentImage;
+        (imageFile ? uploadImage(imageFile) : Promise.resolve(null))
+            .then(imageId => streamMessage(message, imageId, {
+                onToken: function(text) {
+                    // Swap the typing indicator for the bot message on the first token
+                    if (typingIndicator.parentNode) {
+                        chatContainer.replaceChild(botMessage, typingIndicator);
+                    }
+                    streamedText += text;
+                    scheduleRender();
+                }
+            }))
             .then(response => {
-                // Remove typing indicator
-                chatContainer.removeChild(typingIndicator);
+                // Remove typing indicator if no token arrived
+                if (typingIndicator.parentNode) {
+                    chatContainer.replaceChild(botMessage, typingIndicator);
+                }
                 
-                // Add bot response - now using HTML directly since server sends markdown converted to HTML
-                const botMessage = document.createElement('div');
-                botMessage.className = 'message bot-message';
-                botMessage.innerHTML = `
-                    <div class="message-content">
-                        ${response.response}
-                    </div>
-                `;
-                chatContainer.appendChild(botMessage);
+                // Replace the incremental rendering with the server-sanitized HTML
+                streamFinished = true;
+                botContent.innerHTML = response.response;
                 
-                // Update conversation ID
-                if (!currentConversationId) {
-                    currentConversationId = response.conversation_id;
-                    loadChatHistory();
-                }
+                // Update conversation ID and move it to the top of the sidebar without refetching
+                currentConversationId = response.conversation_id;
+                upsertHistoryItem({
+                    id: response.conversation_id,
+                    title: message || '[Image uploaded]'
+                });
                 
                 // Scroll to bottom
                 chatContainer.scrollTop = chatContainer.scrollHeight;
             })
             .catch(error => {
                 console.error('Error:', error);
-                chatContainer.removeChild(typingIndicator);
+                if (typingIndicator.parentNode) {
+                    chatContainer.removeChild(typingIndicator);
+                }
+                if (botMessage.parentNode && !streamedText) {
+                    chatContainer.removeChild(botMessage);
+                }
                 
-                const errorMessage = createMessageElement('Sorry, I encountered an error. Please try again.', true);
+                let errorText = error.userMessage || 'Sorry, I encountered an error. Please try again.';
+                if (error.retryAfter) {
+                    errorText += ` You can send another message in ${error.retryAfter} seconds.`;
+                    pauseSending(error.retryAfter);
+                }
+                // Bot messages are inserted as HTML, escape the server's text
+                const tempDiv = document.createElement('div');
+                tempDiv.textContent = errorText;
+                const errorMessage = createMessageElement(tempDiv.innerHTML, true);
                 chatContainer.appendChild(errorMessage);
                 
                 chatContainer.scrollTop = chatContainer.scrollHeight;
@@ -136,32 +183,166 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Reset current image
         currentImage = null;
+        currentImageUrl = null;
     });
     
-    // Function to send message to server
-    async function sendMessage(message, image) {
+    // Function to upload an image as multipart/form-data, resolving with its image ID
+    async function uploadImage(file) {
+        const formData = new FormData();
+        formData.append('image', file);
+        if (currentConversationId) {
+            formData.append('conversation_id', currentConversationId);
+        }
+        
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) {
+            throw new Error('Image upload failed');
+        }
+        
+        // The image is filed under the conversation the message will be sent to
+        const data = await response.json();
+        currentConversationId = data.conversation_id;
+        return data.image_id;
+    }
+    
+    // Function to build the chat request body
+    function buildChatRequest(message, imageId) {
         const data = {
             message: message,
             conversation_id: currentConversationId
         };
         
-        if (image) {
-            data.image = image; // Send the complete data URL
+        if (imageId) {
+            data.image_id = imageId;
         }
         
-        const response = await fetch('/api/chat', {
+        return data;
+    }
+    
+    // Function to stream a message over Server-Sent Events, resolving with the final payload
+    async function streamMessage(message, imageId, handlers) {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
             },
-            body: JSON.stringify(data)
+            body: JSON.stringify(buildChatRequest(message, imageId))
         });
         
         if (!response.ok) {
-            throw new Error('Network response was not ok');
+            throw await responseError(response);
+        }
+        
+        // Older browsers can't read the body incrementally, handle all events at once
+        if (!response.body || !window.TextDecoder) {
+            const frames = (await response.text()).split('\n\n');
+            for (const frame of frames) {
+                const result = handleSseFrame(frame, handlers);
+                if (result) return result;
+            }
+            throw new Error('Stream ended before the response was complete');
         }
         
-        return response.json();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const result = handleSseFrame(buffer.slice(0, boundary), handlers);
+                buffer = buffer.slice(boundary + 2);
+                if (result) return result;
+            }
+        }
+        
+        throw new Error('Stream ended before the response was complete');
+    }
+    
+    // Function to turn a failed response into an Error, keeping the server's message for rate limits
+    async function responseError(response) {
+        const error = new Error('Network response was not ok');
+        if (response.status !== 429) return error;
+        
+        try {
+            const data = await response.json();
+            error.userMessage = data.message || data.error;
+        } catch (e) {
+            // Not JSON, keep the generic message
+        }
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+        if (retryAfter > 0) {
+            error.retryAfter = retryAfter;
+        }
+        return error;
+    }
+    
+    // Function to disable sending until the rate limit's Retry-After has passed
+    function pauseSending(seconds) {
+        const sendButton = document.getElementById('send-btn');
+        if (!sendButton) return;
+        sendButton.disabled = true;
+        setTimeout(function() {
+            sendButton.disabled = false;
+        }, seconds * 1000);
+    }
+    
+    // Function to dispatch one SSE frame, returning the final payload on the 'done' event
+    function handleSseFrame(frame, handlers) {
+        if (!frame.trim()) return null;
+        
+        const event = parseSseEvent(frame);
+        if (event.type === 'token') {
+            handlers.onToken(event.data.text);
+        } else if (event.type === 'done') {
+            return event.data;
+        } else if (event.type === 'error') {
+            throw new Error(event.data.error);
+        }
+        return null;
+    }
+    
+    // Function to parse a single Server-Sent Events frame
+    function parseSseEvent(frame) {
+        let type = 'message';
+        const dataLines = [];
+        
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        
+        return { type: type, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+    }
+    
+    // Function to render partial markdown while a response is streaming
+    function renderMarkdown(text) {
+        // Fall back to escaped text if the markdown libraries didn't load
+        if (!window.marked || !window.DOMPurify) {
+            const tempDiv = document.createElement('div');
+            tempDiv.textContent = text;
+            return formatMessage(tempDiv.innerHTML);
+        }
+        
+        // Keep the same tags the server allows
+        return DOMPurify.sanitize(marked.parse(text), {
+            ALLOWED_TAGS: ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em',
+                           'ul', 'ol', 'li', 'blockquote', 'code', 'pre', 'br', 'a'],
+            ALLOWED_ATTR: ['href', 'title']
+        });
     }
     
     // Function to create message element
@@ -183,7 +364,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // If there's an image ID associated with this message, display it
             if (imageId) {
                 const imageElement = document.createElement('img');
-                imageElement.src = `/api/images/${imageId}`;
+                imageElement.src = `/api/images/${imageId}?size=thumb`;
                 imageElement.alt = "Uploaded image";
                 imageElement.style.maxWidth = '200px';
                 imageElement.style.maxHeight = '200px';
@@ -229,64 +410,237 @@ document.addEventListener('DOMContentLoaded', function() {
         removeButton.addEventListener('click', function() {
             imagePreviewContainer.innerHTML = '';
             currentImage = null;
+            currentImageUrl = null;
             imageUpload.value = '';
         });
     }
     
-    // Function to load chat history
-    async function loadChatHistory() {
+    // Function to read the sidebar cache kept between page loads
+    function readHistoryCache() {
+        // Without a key from the server there's no way to tell whose cache this is
+        if (!historyContainer.dataset.historyKey) return null;
         try {
-            const response = await fetch('/api/history');
+            // Drop the cache older versions shared between everyone using this browser
+            localStorage.removeItem('olive-history');
+            return JSON.parse(localStorage.getItem(HISTORY_CACHE_KEY));
+        } catch (error) {
+            return null;
+        }
+    }
+    
+    // Function to save the sidebar cache, ignoring storage that is full or disabled
+    function writeHistoryCache(cache) {
+        if (!historyContainer.dataset.historyKey) return;
+        try {
+            localStorage.setItem(HISTORY_CACHE_KEY, JSON.stringify(cache));
+        } catch (error) {
+            console.error('Error caching history:', error);
+        }
+    }
+    
+    // Function to show the cached conversations, with a "Load more" button if there are older ones
+    function renderHistory(cache) {
+        historyContainer.innerHTML = '';
+        if (cache.conversations.length === 0) {
+            showEmptyHistory();
+            return;
+        }
+        cache.conversations.forEach(conversation => {
+            historyContainer.appendChild(createHistoryItem(conversation));
+        });
+        addLoadMoreButton(cache.next_cursor);
+    }
+    
+    // Function to offer the next page of history if there is one
+    function addLoadMoreButton(cursor) {
+        historyCursor = cursor;
+        if (historyCursor) {
+            const loadMoreButton = document.createElement('button');
+            loadMoreButton.className = 'new-chat-btn load-more-btn';
+            loadMoreButton.textContent = 'Load more';
+            loadMoreButton.addEventListener('click', function() {
+                loadChatHistory(historyCursor);
+            });
+            historyContainer.appendChild(loadMoreButton);
+        }
+    }
+    
+    // Function to load a page of chat history, replacing the list unless a cursor is given
+    async function loadChatHistory(cursor = null) {
+        try {
+            const url = cursor ? `/api/history?cursor=${encodeURIComponent(cursor)}` : '/api/history';
+            // The browser revalidates with the ETag, so an unchanged page comes back as an empty 304
+            const response = await fetch(url);
             const data = await response.json();
             
-            historyContainer.innerHTML = '';
+            if (!cursor) {
+                historyCache = {
+                    since: data.since,
+                    count: data.count,
+                    conversations: data.conversations,
+                    next_cursor: data.next_cursor
+                };
+                writeHistoryCache(historyCache);
+                renderHistory(historyCache);
+                return;
+            }
+            
+            removeLoadMoreButton();
+            data.conversations.forEach(conversation => {
+                historyContainer.appendChild(createHistoryItem(conversation));
+            });
+            addLoadMoreButton(data.next_cursor);
             
-            if (data.length === 0) {
-                const emptyMessage = document.createElement('div');
-                emptyMessage.textContent = 'No conversation history';
-                emptyMessage.style.color = '#888';
-                emptyMessage.style.textAlign = 'center';
-                emptyMessage.style.padding = '16px 0';
-                historyContainer.appendChild(emptyMessage);
+            if (historyCache) {
+                historyCache.conversations = historyCache.conversations.concat(data.conversations);
+                historyCache.next_cursor = data.next_cursor;
+                writeHistoryCache(historyCache);
+            }
+        } catch (error) {
+            console.error('Error loading history:', error);
+        }
+    }
+    
+    // Function to show the cached history right away, then fetch only what changed since it was saved
+    async function syncChatHistory() {
+        const cache = readHistoryCache();
+        if (!cache || !cache.since) {
+            loadChatHistory();
+            return;
+        }
+        historyCache = cache;
+        renderHistory(cache);
+        
+        try {
+            const response = await fetch(`/api/history?since=${encodeURIComponent(cache.since)}`);
+            if (!response.ok) {
+                throw new Error(`History sync failed with status ${response.status}`);
+            }
+            const data = await response.json();
+            if (data.reset) {
+                loadChatHistory();
                 return;
             }
             
-            data.forEach(conversation => {
-                const historyItem = document.createElement('div');
-                historyItem.className = 'history-item';
-                historyItem.dataset.id = conversation.id;
-                
-                // Get a clean text version for display (strip HTML tags if present)
-                let displayText = conversation.last_message;
-                if (displayText.includes('<')) {
-                    // Create a temporary div to strip HTML
-                    const tempDiv = document.createElement('div');
-                    tempDiv.innerHTML = displayText;
-                    displayText = tempDiv.textContent || tempDiv.innerText;
-                }
-                
-                historyItem.textContent = displayText.length > 30 
-                    ? displayText.substring(0, 30) + '...' 
-                    : displayText;
-                
-                // Highlight current conversation
-                if (conversation.id === currentConversationId) {
-                    historyItem.style.backgroundColor = 'var(--secondary-color)';
+            // Replace changed conversations and add new ones
+            const byId = new Map(cache.conversations.map(conversation => [conversation.id, conversation]));
+            let added = 0;
+            data.conversations.forEach(conversation => {
+                if (!byId.has(conversation.id)) {
+                    added++;
                 }
-                
-                historyItem.addEventListener('click', function() {
-                    loadConversation(conversation.id, conversation.messages);
-                });
-                
-                historyContainer.appendChild(historyItem);
+                byId.set(conversation.id, conversation);
             });
+            
+            // A different total means the cache doesn't match the server (e.g. a new session), start over
+            if (cache.count + added !== data.count) {
+                loadChatHistory();
+                return;
+            }
+            
+            cache.conversations = Array.from(byId.values()).sort((a, b) =>
+                b.timestamp.localeCompare(a.timestamp) || b.id.localeCompare(a.id));
+            cache.since = data.since;
+            cache.count = data.count;
+            writeHistoryCache(cache);
+            if (data.conversations.length > 0) {
+                renderHistory(cache);
+            }
         } catch (error) {
-            console.error('Error loading history:', error);
+            console.error('Error syncing history:', error);
+            loadChatHistory();
         }
     }
     
-    // Function to load a specific conversation
-    function loadConversation(conversationId, messages) {
+    // Function to show the empty history message
+    function showEmptyHistory() {
+        const emptyMessage = document.createElement('div');
+        emptyMessage.className = 'history-empty';
+        emptyMessage.textContent = 'No conversation history';
+        emptyMessage.style.color = '#888';
+        emptyMessage.style.textAlign = 'center';
+        emptyMessage.style.padding = '16px 0';
+        historyContainer.appendChild(emptyMessage);
+    }
+    
+    // Function to remove the "Load more" button before the list changes
+    function removeLoadMoreButton() {
+        const loadMoreButton = historyContainer.querySelector('.load-more-btn');
+        if (loadMoreButton) {
+            loadMoreButton.remove();
+        }
+    }
+    
+    // Function to create a sidebar entry for a conversation summary
+    function createHistoryItem(conversation) {
+        const historyItem = document.createElement('div');
+        historyItem.className = 'history-item';
+        historyItem.dataset.id = conversation.id;
+        
+        // Get a clean text version for display (strip HTML tags if present)
+        let displayText = conversation.title || '';
+        if (displayText.includes('<')) {
+            // Create a temporary div to strip HTML
+            const tempDiv = document.createElement('div');
+            tempDiv.innerHTML = displayText;
+            displayText = tempDiv.textContent || tempDiv.innerText;
+        }
+        
+        historyItem.textContent = displayText.length > 30 
+            ? displayText.substring(0, 30) + '...' 
+            : displayText;
+        
+        // Highlight current conversation
+        if (conversation.id === currentConversationId) {
+            historyItem.style.backgroundColor = 'var(--secondary-color)';
+        }
+        
+        historyItem.addEventListener('click', function() {
+            loadConversation(conversation.id);
+        });
+        
+        return historyItem;
+    }
+    
+    // Function to move a conversation to the top of the sidebar, adding it if it's new
+    function upsertHistoryItem(conversation) {
+        const emptyMessage = historyContainer.querySelector('.history-empty');
+        if (emptyMessage) {
+            emptyMessage.remove();
+        }
+        
+        let historyItem = historyContainer.querySelector(`.history-item[data-id="${CSS.escape(conversation.id)}"]`);
+        if (!historyItem) {
+            historyItem = createHistoryItem(conversation);
+        }
+        historyContainer.insertBefore(historyItem, historyContainer.firstChild);
+        highlightHistoryItem(conversation.id);
+    }
+    
+    // Function to highlight the current conversation in the sidebar
+    function highlightHistoryItem(conversationId) {
+        const historyItems = document.querySelectorAll('.history-item');
+        historyItems.forEach(item => {
+            if (item.dataset.id === conversationId) {
+                item.style.backgroundColor = 'var(--secondary-color)';
+            } else {
+                item.style.backgroundColor = '';
+            }
+        });
+    }
+    
+    // Function to load a specific conversation, fetching its messages on demand
+    async function loadConversation(conversationId) {
+        let messages;
+        try {
+            const response = await fetch(`/api/history/${encodeURIComponent(conversationId)}`);
+            const data = await response.json();
+            messages = data.messages;
+        } catch (error) {
+            console.error('Error loading conversation:', error);
+            return;
+        }
+        
         currentConversationId = conversationId;
         clearChat();
         
@@ -304,7 +658,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 imageElement.className = 'message user-message';
                 imageElement.innerHTML = `
                     <div class="message-content">
-                        <img src="/api/images/${imageId}" alt="User uploaded image" style="max-width: 200px; max-height: 200px; border-radius: 8px;">
+                        <img src="/api/images/${imageId}?size=thumb" alt="User uploaded image" style="max-width: 200px; max-height: 200px; border-radius: 8px;">
                     </div>
                 `;
                 chatContainer.appendChild(imageElement);
@@ -319,21 +673,131 @@ document.addEventListener('DOMContentLoaded', function() {
         sidebar.classList.remove('active');
         
         // Update history item highlighting
-        const historyItems = document.querySelectorAll('.history-item');
-        historyItems.forEach(item => {
-            if (item.dataset.id === conversationId) {
-                item.style.backgroundColor = 'var(--secondary-color)';
-            } else {
-                item.style.backgroundColor = '';
+        highlightHistoryItem(conversationId);
+    }
+    
+    // Function to search past messages, replacing the results unless an offset is given
+    async function searchHistory(query, offset = 0) {
+        // A newer keystroke makes the previous request's results stale
+        if (searchController) {
+            searchController.abort();
+        }
+        searchController = new AbortController();
+        
+        let data;
+        try {
+            const params = new URLSearchParams({ q: query, offset: offset });
+            const response = await fetch(`/api/search?${params}`, { signal: searchController.signal });
+            data = await response.json();
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Error searching history:', error);
             }
+            return;
+        }
+        
+        if (offset === 0) {
+            searchResults.innerHTML = '';
+        }
+        const loadMoreButton = searchResults.querySelector('.load-more-btn');
+        if (loadMoreButton) {
+            loadMoreButton.remove();
+        }
+        
+        if (offset === 0 && (!data.results || data.results.length === 0)) {
+            const emptyMessage = document.createElement('div');
+            emptyMessage.className = 'history-empty';
+            emptyMessage.textContent = 'No matching messages';
+            emptyMessage.style.color = '#888';
+            emptyMessage.style.textAlign = 'center';
+            emptyMessage.style.padding = '16px 0';
+            searchResults.appendChild(emptyMessage);
+            return;
+        }
+        
+        data.results.forEach(result => {
+            searchResults.appendChild(createSearchResult(result));
+        });
+        
+        if (data.next_offset !== null) {
+            const moreButton = document.createElement('button');
+            moreButton.className = 'new-chat-btn load-more-btn';
+            moreButton.textContent = 'More results';
+            moreButton.addEventListener('click', function() {
+                searchHistory(query, data.next_offset);
+            });
+            searchResults.appendChild(moreButton);
+        }
+    }
+    
+    // Function to create a search result entry that opens its conversation
+    function createSearchResult(result) {
+        const resultItem = document.createElement('div');
+        resultItem.className = 'history-item';
+        
+        const title = document.createElement('div');
+        title.className = 'search-result-title';
+        title.textContent = result.title || 'Conversation';
+        resultItem.appendChild(title);
+        
+        // The server escapes the snippet and only adds <mark> around matches
+        const snippet = document.createElement('div');
+        snippet.className = 'search-result-snippet';
+        if (window.DOMPurify) {
+            snippet.innerHTML = DOMPurify.sanitize(result.snippet, { ALLOWED_TAGS: ['mark'] });
+        } else {
+            appendMarkedSnippet(snippet, result.snippet || '');
+        }
+        resultItem.appendChild(snippet);
+        
+        resultItem.addEventListener('click', function() {
+            loadConversation(result.conversation_id);
         });
+        return resultItem;
     }
     
+    // Function to insert the escaped snippet without DOMPurify, keeping only the <mark> tags
+    function appendMarkedSnippet(container, snippet) {
+        const decoder = document.createElement('textarea');
+        let target = container;
+        snippet.split(/(<\/?mark>)/).forEach(part => {
+            if (part === '<mark>') {
+                target = document.createElement('mark');
+                container.appendChild(target);
+            } else if (part === '</mark>') {
+                target = container;
+            } else if (part) {
+                // Decode the server's entities and insert the result as plain text
+                decoder.innerHTML = part;
+                target.appendChild(document.createTextNode(decoder.value));
+            }
+        });
+    }
+    
+    // Search as the user types, showing the regular history again when the box is cleared
+    historySearch.addEventListener('input', function() {
+        clearTimeout(searchTimer);
+        const query = historySearch.value.trim();
+        if (!query) {
+            if (searchController) {
+                searchController.abort();
+            }
+            searchResults.hidden = true;
+            historyContainer.hidden = false;
+            return;
+        }
+        searchTimer = setTimeout(function() {
+            searchResults.hidden = false;
+            historyContainer.hidden = true;
+            searchHistory(query);
+        }, 250);
+    });
+    
     // Function to clear chat
     function clearChat() {
         chatContainer.innerHTML = '';
     }
     
-    // Load chat history on page load
-    loadChatHistory();
+    // Load chat history on page load, from the local cache when there is one
+    syncChatHistory();
 });
\ No newline at end of file